@@ -0,0 +1,196 @@
+"""Онлайн-обнаружение деградаций по сохраненным результатам.
+
+Для каждой серии (сервер или час суток × метрика) хранится небольшое
+состояние: EWMA среднего и дисперсии, скользящее окно последних значений
+для медианы/MAD и накопленная сумма CUSUM. Каждый новый результат
+обновляет только затронутые серии — история заново не читается.
+
+Ping скошен вправо (редкие длинные задержки — норма), поэтому его серии
+оцениваются в логарифмической шкале. Выброс считается деградацией, только
+если повторился несколько тестов подряд: одиночный всплеск — шум.
+"""
+import json
+import math
+import statistics
+from dataclasses import dataclass
+
+# Для каких метрик хуже меньшее значение, а для каких — большее
+METRIC_DIRECTIONS = {"download": -1, "upload": -1, "ping": 1}
+METRIC_TITLES = {"download": "Скорость загрузки", "upload": "Скорость отдачи", "ping": "Ping"}
+METRIC_UNITS = {"download": "Мбит/с", "upload": "Мбит/с", "ping": "мс"}
+# Метрики с правосторонней асимметрией: детектор работает с логарифмом значения
+LOG_SCALE_METRICS = ("ping",)
+
+
+@dataclass
+class Anomaly:
+    """Обнаруженная деградация"""
+    timestamp: str
+    scope: str  # "server" или "hour"
+    name: str  # имя сервера или час суток
+    metric: str
+    value: float
+    baseline: float
+    score: float
+    kind: str  # "outlier" — выброс несколько тестов подряд, "shift" — устойчивое изменение
+
+    def describe(self):
+        if self.scope == "server":
+            where = f"сервер {self.name}"
+        else:
+            probe, _, hour = self.name.rpartition("/")
+            where = f"{probe} в {hour}:00" if probe else f"в {hour}:00"
+        what = "резкое ухудшение несколько тестов подряд" if self.kind == "outlier" else "устойчивое ухудшение"
+        unit = METRIC_UNITS[self.metric]
+        return (f"{METRIC_TITLES[self.metric]} ({where}): {self.value:.1f} {unit} "
+                f"при обычных {self.baseline:.1f} {unit} — {what}")
+
+
+class SeriesDetector:
+    """Детектор для одной серии значений"""
+
+    WINDOW = 30  # Размер окна для медианы/MAD
+    MIN_HISTORY = 8  # Сколько значений нужно, прежде чем делать выводы
+    ALPHA = 0.1  # Вес нового значения в EWMA
+    OUTLIER_Z = 3.5  # Порог робастного z (Iglewicz & Hoaglin)
+    OUTLIER_RUN = 2  # Сколько выбросов подряд нужно для сообщения
+    CUSUM_K = 0.5  # Допустимый дрейф в сигмах
+    CUSUM_H = 8.0  # Порог срабатывания CUSUM (~10⁴ значений между ложными срабатываниями)
+    CUSUM_CLIP = 4.0  # Ограничение вклада одного значения: разовый выброс не считается сдвигом
+    MIN_RELATIVE_SPREAD = 0.05  # Нижняя граница разброса: 5% от уровня
+
+    def __init__(self, state=None, log_scale=False):
+        state = state or {}
+        if state.get("log_scale", False) != log_scale:
+            state = {}  # Состояние в другой шкале не годится: обучаемся заново
+        self.log_scale = log_scale
+        self.count = state.get("count", 0)
+        self.ewma = state.get("ewma")
+        self.ewm_var = state.get("ewm_var", 0.0)
+        self.window = state.get("window", [])
+        self.cusum = state.get("cusum", 0.0)
+        self.outlier_run = state.get("outlier_run", 0)
+
+    def state(self):
+        return {
+            "count": self.count,
+            "ewma": self.ewma,
+            "ewm_var": self.ewm_var,
+            "window": self.window,
+            "cusum": self.cusum,
+            "outlier_run": self.outlier_run,
+            "log_scale": self.log_scale,
+        }
+
+    def _spread_floor(self, level):
+        if self.log_scale:
+            # В логарифмической шкале относительный разброс — это просто разность
+            return self.MIN_RELATIVE_SPREAD
+        return max(abs(level) * self.MIN_RELATIVE_SPREAD, 1e-6)
+
+    def _to_scale(self, value):
+        return math.log(max(value, 1e-3)) if self.log_scale else value
+
+    def _from_scale(self, value):
+        return math.exp(value) if self.log_scale else value
+
+    def update(self, value, direction):
+        """Учесть значение; вернуть список (kind, baseline, score) для деградаций.
+
+        direction: -1, если хуже меньшее значение (скорость), 1 — если большее (ping).
+        baseline возвращается в исходных единицах метрики.
+        """
+        value = self._to_scale(value)
+        findings = []
+        if self.count >= self.MIN_HISTORY:
+            median = statistics.median(self.window)
+            mad = statistics.median(abs(x - median) for x in self.window)
+            robust_z = direction * (value - median) / max(1.4826 * mad, self._spread_floor(median))
+            if robust_z > self.OUTLIER_Z:
+                self.outlier_run += 1
+                # Сообщаем один раз за серию выбросов, когда она достигла нужной длины
+                if self.outlier_run == self.OUTLIER_RUN:
+                    findings.append(("outlier", self._from_scale(median), robust_z))
+            else:
+                self.outlier_run = 0
+
+            sigma = max(math.sqrt(self.ewm_var), self._spread_floor(self.ewma))
+            z = direction * (value - self.ewma) / sigma
+            z = max(-self.CUSUM_CLIP, min(self.CUSUM_CLIP, z))
+            self.cusum = max(0.0, self.cusum + z - self.CUSUM_K)
+            if self.cusum > self.CUSUM_H:
+                findings.append(("shift", self._from_scale(self.ewma), self.cusum))
+                # Точка изменения: прежняя база больше не актуальна, обучаемся заново
+                self.count = 1
+                self.ewma = value
+                self.ewm_var = 0.0
+                self.window = [value]
+                self.cusum = 0.0
+                self.outlier_run = 0
+                return findings
+
+        if self.ewma is None:
+            self.ewma = value
+        elif self.cusum < self.CUSUM_H / 2:
+            # Пока копится подозрение на сдвиг, база не подстраивается под новые значения,
+            # иначе EWMA догоняет сдвиг раньше, чем CUSUM успевает сработать
+            diff = value - self.ewma
+            self.ewma += self.ALPHA * diff
+            self.ewm_var = (1 - self.ALPHA) * (self.ewm_var + self.ALPHA * diff * diff)
+        self.window = (self.window + [value])[-self.WINDOW:]
+        self.count += 1
+        return findings
+
+
+class AnomalyDetector:
+    """Обновление детекторов в той же транзакции, что и запись результата"""
+
+    def __init__(self, table="detector_state"):
+        self.table = table
+
+    @staticmethod
+    def series_keys(row):
+        hour = str(row["timestamp"])[11:13]
+        server = row.get("server_name")
+        # В центральной БД серии ведутся отдельно для каждой пробы
+        if row.get("probe"):
+            hour = f"{row['probe']}/{hour}"
+            server = server and f"{row['probe']}/{server}"
+        keys = [("hour", hour)]
+        if server:
+            keys.append(("server", server))
+        return keys
+
+    def process(self, cursor, rows, record=True):
+        """Пропустить успешные результаты через детекторы; вернуть найденные Anomaly"""
+        anomalies = []
+        detectors = {}
+        for row in rows:
+            for scope, name in self.series_keys(row):
+                for metric, direction in METRIC_DIRECTIONS.items():
+                    value = row.get(metric)
+                    if value is None:
+                        continue
+                    key = f"{scope}:{name}:{metric}"
+                    if key not in detectors:
+                        saved = cursor.execute(
+                            f"SELECT state FROM {self.table} WHERE key = ?", (key,)
+                        ).fetchone()
+                        detectors[key] = SeriesDetector(json.loads(saved[0]) if saved else None,
+                                                        log_scale=metric in LOG_SCALE_METRICS)
+                    for kind, baseline, score in detectors[key].update(value, direction):
+                        anomalies.append(Anomaly(str(row["timestamp"]), scope, name, metric,
+                                                 value, baseline, score, kind))
+
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {self.table} (key, state) VALUES (?, ?)",
+            [(key, json.dumps(detector.state())) for key, detector in detectors.items()]
+        )
+        if record and anomalies:
+            cursor.executemany(
+                "INSERT INTO anomalies (timestamp, scope, name, metric, value, baseline, score, kind) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(a.timestamp, a.scope, a.name, a.metric, a.value, a.baseline, a.score, a.kind)
+                 for a in anomalies]
+            )
+        return anomalies if record else []
@@ -0,0 +1,428 @@
+"""Бенчмарки хранилища, аналитики и отрисовки на синтетической истории.
+
+Для каждого размера истории (по умолчанию 10³–10⁵ строк, до 10⁷ по
+запросу) создается воспроизводимая БД со случайными результатами; БД
+кешируются в --data-dir и переиспользуются. GUI-пути выполняются без
+показа окна на платформе Qt offscreen.
+
+Для каждого пути и размера измеряются медиана и минимум времени
+(несколько повторов) и пиковая память по tracemalloc (отдельным
+прогоном, чтобы трассировка не искажала время). Весь набор проходится
+--rounds раз; берется лучший результат, а расхождение между прогонами
+сохраняется в базе как разброс и расширяет допуск при сравнении.
+
+Результаты сравниваются с сохраненной базой (bench_baseline.json в
+репозитории); все ключи из базы измеряются, даже если не укладываются в
+--budget. Код выхода 1 — регрессия; 2 — сравнение неполное: нет базы,
+путь пропущен из-за отсутствующей зависимости или его нет в базе.
+База записывается только при всех установленных зависимостях.
+
+Примеры:
+    python -m speed_bench                                # сравнить с bench_baseline.json
+    python -m speed_bench --save-baseline                # записать новую базу
+    python -m speed_bench --sizes 1e3,1e6 --paths get_tests,get_percentile
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from speed_storage import DatabaseManager
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+DEFAULT_BASELINE = "bench_baseline.json"
+SERVERS = (("Rostelecom", "Russia"), ("MTS", "Russia"), ("Beeline", "Russia"),
+           ("Hetzner", "Germany"), ("Cloudflare", "Netherlands"))
+SEED = 20260101
+
+
+def synthetic_rows(count, seed=SEED):
+    """Воспроизводимые результаты тестов раз в 5 минут, заканчивающиеся сейчас"""
+    rng = random.Random(seed)
+    started = datetime.now() - timedelta(minutes=5 * count)
+    for i in range(count):
+        server_name, server_country = SERVERS[rng.randrange(len(SERVERS))]
+        success = rng.random() > 0.02
+        yield (
+            str(started + timedelta(minutes=5 * i)),
+            rng.lognormvariate(3.0, 0.4) if success else 0,
+            rng.lognormvariate(4.5, 0.5) if success else 0,
+            rng.lognormvariate(3.5, 0.5) if success else 0,
+            server_name if success else "",
+            server_country if success else "",
+            int(success),
+        )
+
+
+def open_database(path):
+    return DatabaseManager(path, lazy=True)
+
+
+def make_database(size, data_dir):
+    """Синтетическая БД на size строк (создается один раз и кешируется)"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"tests_{size}_{SEED}.db")
+    if os.path.exists(path):
+        return open_database(path)
+
+    print(f"Создание синтетической БД: {size} строк...", file=sys.stderr)
+    partial = path + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    # Пустая схема, затем строки напрямую, затем повторная инициализация:
+    # гистограмма и детекторы заполняются так же, как для уже накопленной истории
+    open_database(partial).init_db()
+    conn = sqlite3.connect(partial)
+    rows = synthetic_rows(size)
+    while True:
+        chunk = [row for _, row in zip(range(100_000), rows)]
+        if not chunk:
+            break
+        conn.executemany(
+            f"INSERT INTO tests ({', '.join(DatabaseManager.BASE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            chunk
+        )
+    conn.commit()
+    conn.close()
+    open_database(partial).init_db()
+
+    os.replace(partial, path)
+    return open_database(path)
+
+
+class GuiFixture:
+    """Главное окно без показа (Qt offscreen) с уже созданными графиками"""
+
+    def __init__(self):
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtWidgets import QApplication
+
+        import speed_monitor_gui
+
+        self.app = QApplication.instance() or QApplication(sys.argv[:1])
+        self.module = speed_monitor_gui
+        self.window = speed_monitor_gui.EnhancedMainWindow()
+        self.window.resize(1400, 900)
+        window = self.window
+        window.speed_figure, window.speed_canvas = window.create_chart(window.speed_tab)
+        window.ping_figure, window.ping_canvas = window.create_chart(window.ping_tab)
+
+        self.gauge = speed_monitor_gui.SpeedometerWidget("Загрузка", 1000, "Мбит/с")
+        self.gauge.resize(300, 300)
+        self.gauge.value = self.gauge.target_value = 420
+
+    def use(self, db):
+        self.window.db = db
+        self.window.probe_summary = None
+        self.window.anomalies = db.get_anomalies()
+
+
+class Benchmarks:
+    """Измеряемые пути: каждый метод готовит данные и возвращает функцию для замера"""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.db = None
+        self.df = None
+        self._gui = None
+
+    @property
+    def gui(self):
+        if self._gui is None:
+            self._gui = GuiFixture()
+        return self._gui
+
+    def load(self, size):
+        self.db = make_database(size, self.data_dir)
+        self.df = None
+
+    def history(self):
+        if self.df is None:
+            self.df = self.db.get_tests()
+        return self.df
+
+    def get_tests(self):
+        return self.db.get_tests
+
+    def get_percentile(self):
+        return lambda: [self.db.get_percentile(metric, 0.99) for metric in DatabaseManager.HISTOGRAM_METRICS]
+
+    def iter_tests(self):
+        def read_all():
+            for _ in self.db.iter_tests():
+                pass
+        return read_all
+
+    def get_anomalies(self):
+        return lambda: self.db.get_anomalies(limit=1000)
+
+    def update_history_table(self):
+        self.gui.use(self.db)
+        df = self.history()
+        return lambda: self.gui.window.update_history_table(df)
+
+    def update_charts(self):
+        self.gui.use(self.db)
+        df = self.history()
+
+        def draw():
+            self.gui.window.update_charts(df)
+            self.gui.window.speed_canvas.draw()
+            self.gui.window.ping_canvas.draw()
+        return draw
+
+    def update_statistics(self):
+        self.gui.use(self.db)
+        df = self.history()
+        return lambda: self.gui.window.update_statistics(df)
+
+    def gauge_paint(self):
+        gauge = self.gui.gauge
+        return gauge.grab
+
+
+PATHS = ("get_tests", "get_percentile", "iter_tests", "get_anomalies",
+         "update_history_table", "update_charts", "update_statistics", "gauge_paint")
+SIZE_INDEPENDENT = ("gauge_paint",)  # Замеряются один раз, а не для каждого размера
+MISSING_DEPENDENCY = "нет зависимости"
+# Разница меньше этих значений не считается регрессией (шум коротких замеров)
+MIN_DELTA = {"min_ms": 1.0, "peak_kb": 64}
+# Во сколько раз разброс между прогонами базы расширяет допуск: несколько
+# прогонов видят лишь часть реального разброса
+SPREAD_FACTOR = 2
+
+
+def measure(func, repeat, budget):
+    """Время повторов (не больше budget секунд суммарно) и пик памяти отдельным прогоном"""
+    times = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        run_started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - run_started)
+        if time.perf_counter() - started > budget:
+            break
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "runs": len(times),
+        "peak_kb": peak / 1024,
+    }
+
+
+def result_key(path, size):
+    return f"{path}@{'any' if path in SIZE_INDEPENDENT else size}"
+
+
+def run_benchmarks(sizes, paths, repeat, budget, data_dir, benchmarks=None, required=(), excluded=()):
+    """Замеры путей на каждом размере; возвращает (результаты, {путь: причина пропуска}).
+
+    Путь, не уложившийся в budget, на следующих размерах не измеряется.
+    Ключи из required измеряются всегда, из excluded — никогда: так набор
+    ключей совпадает с базой, даже если путь оказался на границе бюджета.
+    """
+    benchmarks = benchmarks or Benchmarks(data_dir)
+    results = {}
+    skipped = {}  # путь -> причина
+    unavailable = set()  # пути без зависимостей
+    for size in sizes:
+        benchmarks.load(size)
+        for path in paths:
+            key = result_key(path, size)
+            if path in unavailable or key in results or key in excluded:
+                continue
+            if path in skipped and key not in required:
+                continue
+            try:
+                result = measure(getattr(benchmarks, path)(), repeat, budget)
+            except ImportError as e:
+                unavailable.add(path)
+                skipped[path] = f"{MISSING_DEPENDENCY}: {e.name}"
+                print(f"{path}: пропущено ({skipped[path]})", file=sys.stderr)
+                continue
+            results[key] = result
+            print(f"{key:32s} {result['median_ms']:10.2f} мс (min {result['min_ms']:.2f}, "
+                  f"{result['runs']} прог.)  пик {result['peak_kb']:10.0f} КБ", file=sys.stderr)
+            # Слишком медленный путь на больших размерах не проверяем
+            if result["median_ms"] / 1000 > budget:
+                skipped[path] = f"дольше {budget:g} с на {size} строк"
+    return results, skipped
+
+
+def run_rounds(rounds, sizes, paths, repeat, budget, data_dir, required=(), excluded=()):
+    """Несколько прогонов набора: лучший результат и относительный разброс между прогонами"""
+    benchmarks = Benchmarks(data_dir)
+    collected, skipped = [], {}
+    for number in range(rounds):
+        if rounds > 1:
+            print(f"— прогон {number + 1} из {rounds}", file=sys.stderr)
+        results, round_skipped = run_benchmarks(sizes, paths, repeat, budget, data_dir, benchmarks,
+                                                required, excluded)
+        collected.append(results)
+        skipped.update(round_skipped)
+        if number == 0:
+            # Следующие прогоны измеряют ровно те же ключи, что и первый
+            required = set(results)
+            excluded = {result_key(path, size) for size in sizes for path in paths} - required
+
+    merged = {}
+    for key in dict.fromkeys(key for results in collected for key in results):
+        measured = [results[key] for results in collected if key in results]
+        merged[key] = result = {
+            "median_ms": min(item["median_ms"] for item in measured),
+            "min_ms": min(item["min_ms"] for item in measured),
+            "runs": sum(item["runs"] for item in measured),
+            "peak_kb": min(item["peak_kb"] for item in measured),
+            "spread": {},
+        }
+        for metric in MIN_DELTA:
+            values = [item[metric] for item in measured]
+            result["spread"][metric] = (max(values) - min(values)) / min(values) if min(values) > 0 else 0
+    return merged, skipped
+
+
+def planned_keys(sizes, paths, baseline):
+    """Какие ключи измерять при сравнении: (обязательные, исключенные).
+
+    Все, что есть в базе, измеряется независимо от бюджета — иначе медленная
+    регрессия выпала бы из сравнения. Ключи, которые при записи базы были
+    запрошены, но не измерены (не уложились в бюджет), пропускаются.
+    """
+    requested = {result_key(path, size) for size in sizes for path in paths}
+    recorded = set(baseline["results"])
+    covered = {result_key(path, size) for size in baseline.get("sizes", ()) for path in baseline.get("paths", ())}
+    return requested & recorded, (requested & covered) - recorded
+
+
+def compare(results, baseline, tolerance):
+    """Регрессии относительно базы: список строк с описанием.
+
+    Время сравнивается по минимуму повторов — он меньше всего зависит от фоновой нагрузки.
+    Допуск — tolerance плюс SPREAD_FACTOR разбросов между прогонами базы.
+    """
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for metric, unit in (("min_ms", "мс"), ("peak_kb", "КБ")):
+            slack = tolerance + SPREAD_FACTOR * reference.get("spread", {}).get(metric, 0)
+            limit = max(reference[metric] * (1 + slack), reference[metric] + MIN_DELTA[metric])
+            if result[metric] > limit:
+                regressions.append(f"{key}: {metric} {result[metric]:.1f} {unit} > "
+                                   f"{reference[metric]:.1f} {unit} + {slack:.0%}")
+    return regressions
+
+
+def parse_sizes(text):
+    return [int(float(part)) for part in text.split(",") if part]
+
+
+def parse_paths(text):
+    paths = [part for part in text.split(",") if part]
+    unknown = set(paths) - set(PATHS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"неизвестные пути: {', '.join(sorted(unknown))}")
+    return paths
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="speed_bench", description="Бенчмарки Internet Speed Monitor")
+    parser.add_argument("--sizes", type=parse_sizes, default=list(DEFAULT_SIZES),
+                        help="размеры истории через запятую, например 1e3,1e5,1e7")
+    parser.add_argument("--paths", type=parse_paths, default=list(PATHS),
+                        help=f"пути через запятую: {', '.join(PATHS)}")
+    parser.add_argument("--repeat", type=int, default=10, help="число повторов каждого замера")
+    parser.add_argument("--rounds", type=int,
+                        help="сколько раз пройти весь набор (по умолчанию 3 при записи базы, иначе 1)")
+    parser.add_argument("--budget", type=float, default=30,
+                        help="время на один путь и размер, секунды (более медленные пути не растут дальше)")
+    parser.add_argument("--data-dir", default="bench_data", help="каталог для синтетических БД")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="файл с базовыми результатами")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты как новую базу")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="допустимое ухудшение относительно базы (0.25 = 25%%)")
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    baseline = None
+    if not args.save_baseline:
+        if not os.path.exists(args.baseline):
+            print(f"❌ Нет базы {args.baseline} — сравнивать не с чем; запишите ее с --save-baseline",
+                  file=sys.stderr)
+            return 2
+        with open(args.baseline, encoding="utf-8") as stream:
+            baseline = json.load(stream)
+
+    rounds = args.rounds or (3 if args.save_baseline else 1)
+    required, excluded = planned_keys(args.sizes, args.paths, baseline) if baseline else ((), ())
+    results, skipped = run_rounds(rounds, args.sizes, args.paths, args.repeat, args.budget, args.data_dir,
+                                  required, excluded)
+    missing_dependencies = {path: reason for path, reason in skipped.items()
+                            if reason.startswith(MISSING_DEPENDENCY)}
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sizes": args.sizes,
+        "paths": args.paths,
+        "results": results,
+        "skipped": skipped,
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.save_baseline:
+        if missing_dependencies:
+            # База без части путей не защищала бы их от регрессий
+            print(f"❌ База не записана: пропущены {', '.join(missing_dependencies)} "
+                  "(установите зависимости)", file=sys.stderr)
+            return 2
+        with open(args.baseline, "w", encoding="utf-8") as stream:
+            json.dump(report, stream, ensure_ascii=False, indent=2)
+        print(f"База записана: {args.baseline}", file=sys.stderr)
+        return 0
+
+    if baseline.get("platform") != report["platform"]:
+        print(f"⚠️  База снята на другой платформе: {baseline.get('platform')}", file=sys.stderr)
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for line in regressions:
+        print(f"❌ {line}", file=sys.stderr)
+
+    incomplete = [f"{path}: {reason}" for path, reason in missing_dependencies.items()]
+    incomplete += [f"{key}: нет в базе (обновите ее с --save-baseline)"
+                   for key in results if key not in baseline["results"]]
+    for line in incomplete:
+        print(f"❌ Не сравнивается — {line}", file=sys.stderr)
+
+    if regressions:
+        return 1
+    if incomplete:
+        return 2
+    print("✅ Регрессий нет", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,427 @@
+"""Консольный и фоновый режим без Qt, pandas и matplotlib.
+
+Примеры:
+    python -m speed_cli run             # один тест
+    python -m speed_cli run --json      # результат в JSON
+    python -m speed_cli daemon -i 30    # тест каждые 30 минут
+    python -m speed_cli daemon --schedule "*/15 8-20 * * 1-5" --quiet-hours 23:00-07:00
+    python -m speed_cli export history.csv --since 2026-01-01
+    python -m speed_cli probe 1.1.1.1:443 --count 500 --interval 0.02
+    python -m speed_cli --trace trace.json --profile run.prof run
+    python -m speed_cli --db fleet.db aggregate probes/*/internet_speed_enhanced.db
+    python -m speed_cli --db fleet.db fleet --days 7
+"""
+import argparse
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+import speed_trace
+from speed_engine import SpeedTestCancelled, SpeedTestEngine, SpeedTestError, parse_threads
+from speed_export import FORMATS, ExportError, export_tests
+from speed_fleet import AggregationError, aggregate, parse_source
+from speed_metrics import MetricsServer
+from speed_probe import ProbeEngine, parse_target
+from speed_scheduler import (IntervalSchedule, QuietHours, ResultBatchWriter,
+                             ScheduleError, TestScheduler, parse_schedule)
+from speed_storage import DatabaseManager
+
+
+def run_once(db, quiet=False, as_json=False, bufferbloat=False, threads=None, cancel_event=None):
+    """Один тест с сохранением результата; возвращает True при успехе, None при отмене.
+
+    db — DatabaseManager или ResultBatchWriter (оба реализуют save_test).
+    cancel_event — threading.Event, установка которого прерывает тест.
+    """
+    def on_progress(value, message):
+        if not quiet:
+            print(f"[{value:3d}%] {message}", file=sys.stderr)
+
+    engine = SpeedTestEngine(on_progress=on_progress, ui_pauses=False, bufferbloat=bufferbloat,
+                             threads=threads, cancel_event=cancel_event)
+    try:
+        result = engine.run()
+    except KeyboardInterrupt:
+        # Потоки передачи speedtest останавливаются по тому же событию
+        engine.cancel()
+        raise
+    except SpeedTestCancelled as e:
+        print(str(e), file=sys.stderr)
+        return None
+    except SpeedTestError as e:
+        db.save_test(0, 0, 0, "", "", False)
+        print(str(e), file=sys.stderr)
+        return False
+
+    db.save_test(result.ping, result.download, result.upload,
+                 result.server_name, result.server_country, **result.extra)
+
+    if as_json:
+        print(json.dumps({
+            "ping": result.ping,
+            "download": result.download,
+            "upload": result.upload,
+            "server_name": result.server_name,
+            "server_country": result.server_country,
+            **result.extra,
+        }, ensure_ascii=False))
+    else:
+        print(f"Download: {result.download:.1f} Мбит/с  "
+              f"Upload: {result.upload:.1f} Мбит/с  "
+              f"Ping: {result.ping:.1f} мс  "
+              f"({result.server_name}, {result.server_country})")
+        if result.extra.get("bufferbloat_grade"):
+            print(f"Задержка под нагрузкой: {format_loaded_latency(result.extra)}")
+        if result.extra.get("threads_mode") == "auto":
+            print(f"Подобрано потоков: загрузка {result.extra['download_threads']}, "
+                  f"отдача {result.extra['upload_threads']}")
+    return True
+
+
+def format_loaded_latency(extra):
+    parts = [f"без нагрузки {extra['idle_latency']:.1f} мс"]
+    if extra.get("loaded_latency_down") is not None:
+        parts.append(f"загрузка {extra['loaded_latency_down']:.1f} мс")
+    if extra.get("loaded_latency_up") is not None:
+        parts.append(f"отдача {extra['loaded_latency_up']:.1f} мс")
+    if extra.get("latency_jitter") is not None:
+        parts.append(f"джиттер {extra['latency_jitter']:.1f} мс")
+    return ", ".join(parts) + f", оценка {extra['bufferbloat_grade']}"
+
+
+def report_anomalies(anomalies):
+    for anomaly in anomalies:
+        logging.warning("⚠️  Деградация: %s", anomaly.describe())
+
+
+def cmd_run(args):
+    db = DatabaseManager(args.db)
+    db.add_anomaly_listener(report_anomalies)
+    try:
+        return 0 if run_once(db, args.quiet, args.json, args.bufferbloat, args.threads) else 1
+    except KeyboardInterrupt:
+        print("⏹ Тест отменен", file=sys.stderr)
+        return 130
+
+
+def format_probe_summary(target, summary):
+    def ms(value):
+        return "—" if value is None else f"{value:.2f}"
+
+    return (f"{target}: отправлено {summary['sent']}, потеряно {summary['lost']} "
+            f"({summary['loss_pct']:.1f}%), rtt min/p50/p90/p99/max = "
+            f"{ms(summary['rtt_min'])}/{ms(summary['rtt_p50'])}/{ms(summary['rtt_p90'])}/"
+            f"{ms(summary['rtt_p99'])}/{ms(summary['rtt_max'])} мс, джиттер {ms(summary['jitter'])} мс")
+
+
+def probe_target(value):
+    """Тип аргумента TARGET: проверяет host[:port] при разборе командной строки"""
+    try:
+        parse_target(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def make_probe_engine(args):
+    host, port = parse_target(args.probe_target, default_port=7 if args.udp else 443)
+    return ProbeEngine(host, port, "udp" if args.udp else "tcp", args.probe_interval, args.probe_timeout)
+
+
+def cmd_probe(args):
+    engine = make_probe_engine(args)
+    db = None if args.no_save else DatabaseManager(args.db)
+
+    def report(summary):
+        if db is not None:
+            db.save_probe(engine.target, engine.mode, summary)
+        if args.json:
+            print(json.dumps({"target": engine.target, "mode": engine.mode, **summary}), flush=True)
+        else:
+            print(format_probe_summary(engine.target, summary), flush=True)
+
+    try:
+        if not args.continuous:
+            report(engine.run(args.count))
+            return 0
+        engine.start_continuous(args.count, report)
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        engine.stop()
+        return 0
+    except OSError as e:
+        print(f"❌ {engine.target}: {e}", file=sys.stderr)
+        return 1
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def cmd_daemon(args):
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        if args.schedule:
+            schedule = parse_schedule(args.schedule)
+        else:
+            schedule = IntervalSchedule(args.interval * 60)
+        quiet_hours = QuietHours.parse(args.quiet_hours) if args.quiet_hours else None
+    except ScheduleError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+
+    db = DatabaseManager(args.db)
+    db.add_anomaly_listener(report_anomalies)
+    writer = ResultBatchWriter(db, args.batch_size, args.flush_interval)
+
+    # Непрерывные зонды между тестами; на время теста скорости они приостанавливаются
+    prober = None
+    if args.probe_target:
+        prober = make_probe_engine(args)
+        try:
+            prober.start_continuous(
+                args.probe_window,
+                lambda summary: db.save_probe(prober.target, prober.mode, summary)
+            )
+        except OSError as e:
+            print(f"❌ {prober.target}: {e}", file=sys.stderr)
+            return 2
+
+    # Событие отмены текущего теста: для вытеснения зависшего теста и при остановке демона
+    current = {"cancel": None}
+
+    def job():
+        cancel_event = current["cancel"] = threading.Event()
+        if prober:
+            prober.pause()
+        try:
+            with speed_trace.profiled():
+                return run_once(writer, args.quiet, args.json, args.bufferbloat, args.threads, cancel_event)
+        finally:
+            if prober:
+                prober.resume()
+
+    def cancel_current():
+        if current["cancel"] is not None:
+            current["cancel"].set()
+
+    scheduler = TestScheduler(
+        schedule,
+        job,
+        jitter=args.jitter,
+        quiet_hours=quiet_hours,
+        max_backoff=args.max_backoff,
+        cancel=cancel_current,
+        max_runtime=args.max_runtime
+    )
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(args.metrics_port, args.metrics_host).start()
+        logging.info("Метрики: http://%s:%d/metrics", args.metrics_host or "0.0.0.0", metrics_server.port)
+
+    logging.info("Расписание: %s", schedule)
+    scheduler.start(run_now=not args.wait)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop(timeout=5)
+        # Идущий тест отменяется и успевает освободить соединения до записи буфера
+        cancel_current()
+        if not scheduler.wait_idle(args.shutdown_timeout):
+            logging.warning("Тест не завершился за %g с, выхожу без него", args.shutdown_timeout)
+        writer.close()
+        if prober:
+            prober.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+    return 0
+
+
+def cmd_export(args):
+    try:
+        count = export_tests(
+            DatabaseManager(args.db), args.output, args.format,
+            since=args.since, until=args.until, server=args.server,
+            include_failed=args.include_failed, chunk_size=args.chunk_size
+        )
+    except (ExportError, OSError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    print(f"Экспортировано строк: {count}", file=sys.stderr)
+    return 0
+
+
+def cmd_aggregate(args):
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    db = DatabaseManager(args.db)
+    db.add_anomaly_listener(report_anomalies)
+
+    def on_progress(probe, result, done):
+        if done and isinstance(result, str):
+            logging.error("❌ %s: %s", probe, result)
+        elif done:
+            logging.info("%s: новых строк %d", probe, result)
+
+    try:
+        results = aggregate(db, [parse_source(source) for source in args.sources],
+                            workers=args.workers, chunk_size=args.chunk_size, on_progress=on_progress)
+    except AggregationError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+
+    failed = [probe for probe, result in results.items() if isinstance(result, str)]
+    total = sum(result for result in results.values() if not isinstance(result, str))
+    print(f"Собрано строк: {total} с {len(results) - len(failed)} проб"
+          + (f", ошибки: {', '.join(failed)}" if failed else ""), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def cmd_fleet(args):
+    summary = DatabaseManager(args.db).get_fleet_summary(args.days)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, default=str))
+        return 0
+
+    def number(value, digits=1):
+        return "—" if value is None else f"{value:.{digits}f}"
+
+    print(f"{'Проба':20s} {'Тестов':>7s} {'Ошибок':>7s} {'Загрузка':>9s} {'Отдача':>8s} {'Ping':>7s}  Последний тест")
+    for probe in summary:
+        print(f"{probe['probe'] or '(локально)':20s} {probe['tests']:7d} {probe['failed']:7d} "
+              f"{number(probe['download']):>9s} {number(probe['upload']):>8s} {number(probe['ping']):>7s}  "
+              f"{str(probe['last_test'] or '—')[:19]}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="speed_cli",
+        description="Internet Speed Monitor без графического интерфейса"
+    )
+    parser.add_argument("--db", metavar="PATH",
+                        help=f"файл БД (по умолчанию ${DatabaseManager.DB_FILE_ENV} или {DatabaseManager.DEFAULT_DB_FILE})")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="записать трассу этапов в FILE (Chrome Trace, открыть в chrome://tracing)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="записать профиль cProfile в FILE (python -m pstats FILE)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="выполнить один тест")
+    run_parser.set_defaults(func=cmd_run)
+
+    daemon_parser = subparsers.add_parser("daemon", help="выполнять тесты периодически")
+    daemon_parser.add_argument("-i", "--interval", type=float, default=60,
+                               help="интервал между тестами в минутах (по умолчанию 60)")
+    daemon_parser.add_argument("-s", "--schedule",
+                               help="расписание: интервал (\"15m\", \"every 2h\") или cron из 5 полей")
+    daemon_parser.add_argument("--jitter", type=float, default=0,
+                               help="случайный сдвиг запуска до N секунд")
+    daemon_parser.add_argument("--quiet-hours", help="не запускать тесты в интервале, например 23:00-07:00")
+    daemon_parser.add_argument("--max-backoff", type=float, default=3600,
+                               help="максимальная пауза после ошибок подряд, секунды")
+    daemon_parser.add_argument("--batch-size", type=int, default=10,
+                               help="записывать результаты в БД пакетами по N")
+    daemon_parser.add_argument("--flush-interval", type=float, default=300,
+                               help="записывать неполный пакет не позже чем через N секунд")
+    daemon_parser.add_argument("--metrics-port", type=int,
+                               help="отдавать метрики Prometheus на этом порту (/metrics)")
+    daemon_parser.add_argument("--metrics-host", default="",
+                               help="адрес для эндпоинта метрик (по умолчанию все интерфейсы)")
+    daemon_parser.add_argument("--probe", dest="probe_target", type=probe_target, metavar="TARGET",
+                               help="между тестами непрерывно измерять задержку до host[:port]")
+    daemon_parser.add_argument("--probe-window", type=int, default=600,
+                               help="сохранять сводку зондов каждые N зондов")
+    daemon_parser.add_argument("--max-runtime", type=float, default=600,
+                               help="тест дольше N секунд отменяется, если подошло время следующего")
+    daemon_parser.add_argument("--shutdown-timeout", type=float, default=15,
+                               help="сколько ждать остановки идущего теста при завершении, секунды")
+    daemon_parser.add_argument("--wait", action="store_true",
+                               help="не запускать первый тест сразу, ждать расписания")
+    daemon_parser.set_defaults(func=cmd_daemon)
+
+    for sub in (run_parser, daemon_parser):
+        sub.add_argument("-q", "--quiet", action="store_true", help="не выводить прогресс")
+        sub.add_argument("--json", action="store_true", help="выводить результат в JSON")
+        sub.add_argument("--bufferbloat", action="store_true",
+                         help="измерять задержку под нагрузкой (bufferbloat)")
+        sub.add_argument("--threads", type=parse_threads, metavar="N|auto",
+                         help="параллельных потоков передачи: число или auto — увеличивать, "
+                              "пока растет скорость (по умолчанию как задает сервер)")
+
+    probe_parser = subparsers.add_parser("probe", help="серия зондов: задержка, джиттер, потери")
+    probe_parser.add_argument("probe_target", nargs="?", default="1.1.1.1:443", type=probe_target,
+                              metavar="TARGET",
+                              help="host[:port] (по умолчанию 1.1.1.1:443)")
+    probe_parser.add_argument("-c", "--count", type=int, default=200,
+                              help="число зондов (в режиме --continuous — размер окна сводки)")
+    probe_parser.add_argument("--continuous", action="store_true", help="работать непрерывно до Ctrl+C")
+    probe_parser.add_argument("--no-save", action="store_true", help="не сохранять сводки в БД")
+    probe_parser.add_argument("--json", action="store_true", help="выводить сводки в JSON")
+    probe_parser.set_defaults(func=cmd_probe)
+
+    for sub in (probe_parser, daemon_parser):
+        sub.add_argument("--udp", action="store_true",
+                         help="зонды UDP echo вместо TCP connect (по умолчанию порт 7)")
+        sub.add_argument("--probe-interval", type=float, default=0.05,
+                         help="интервал между зондами, секунды")
+        sub.add_argument("--probe-timeout", type=float, default=1.0,
+                         help="таймаут зонда (потерей считается ответ позже), секунды")
+
+    export_parser = subparsers.add_parser("export", help="выгрузить историю в CSV/JSONL/Parquet")
+    export_parser.add_argument("output", help="файл для записи или \"-\" для stdout")
+    export_parser.add_argument("-f", "--format", choices=FORMATS,
+                               help="формат (по умолчанию — по расширению файла)")
+    export_parser.add_argument("--since", type=datetime.fromisoformat,
+                               help="начало периода, например 2026-01-01 или 2026-01-01T08:00")
+    export_parser.add_argument("--until", type=datetime.fromisoformat, help="конец периода (не включительно)")
+    export_parser.add_argument("--server", help="только тесты на этом сервере")
+    export_parser.add_argument("--include-failed", action="store_true", help="включить неудачные тесты")
+    export_parser.add_argument("--chunk-size", type=int, default=10000, help="строк за одно чтение из БД")
+    export_parser.set_defaults(func=cmd_export)
+
+    aggregate_parser = subparsers.add_parser(
+        "aggregate", help="дозаписать в БД (--db) новые результаты из БД или экспортов проб"
+    )
+    aggregate_parser.add_argument("sources", nargs="+", metavar="SOURCE",
+                                  help="файл БД или экспорта пробы; имя пробы можно задать как name=path")
+    aggregate_parser.add_argument("-j", "--workers", type=int, default=4, help="число источников, читаемых параллельно")
+    aggregate_parser.add_argument("--chunk-size", type=int, default=10000, help="строк в одной транзакции")
+    aggregate_parser.add_argument("-q", "--quiet", action="store_true", help="выводить только ошибки")
+    aggregate_parser.set_defaults(func=cmd_aggregate)
+
+    fleet_parser = subparsers.add_parser("fleet", help="сводка по пробам в центральной БД")
+    fleet_parser.add_argument("--days", type=float, help="только за последние N дней")
+    fleet_parser.add_argument("--json", action="store_true", help="вывести сводку в JSON")
+    fleet_parser.set_defaults(func=cmd_fleet)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.trace:
+        speed_trace.enable_tracing(args.trace)
+    if args.profile:
+        speed_trace.enable_profiling(args.profile)
+
+    # Демон профилирует каждый тест в потоке планировщика, остальные команды — целиком
+    if args.command == "daemon":
+        return args.func(args)
+    with speed_trace.profiled():
+        return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+"""Движок измерения скорости без зависимостей от Qt.
+
+Используется как GUI (через ImprovedSpeedTestWorker), так и консольным
+режимом speed_cli. Тяжелые библиотеки (speedtest, requests) импортируются
+только в момент реального теста.
+"""
+import math
+import socket
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import speed_metrics
+import speed_trace
+from speed_probe import parse_target, tcp_connect_rtt
+
+
+class SpeedTestError(Exception):
+    """Ошибка теста скорости с сообщением, готовым для показа пользователю"""
+
+
+class SpeedTestCancelled(SpeedTestError):
+    """Тест отменен (пользователем, при закрытии окна или планировщиком)"""
+
+
+@dataclass
+class SpeedTestResult:
+    """Результат успешного теста"""
+    ping: float
+    download: float
+    upload: float
+    server_name: str
+    server_country: str
+    # Дополнительные измерения (колонки tests), например задержка под нагрузкой
+    extra: dict = field(default_factory=dict)
+
+
+def _do_nothing(*args):
+    pass
+
+
+@contextmanager
+def _stage(name):
+    """Замер длительности этапа теста в гистограмму speed_metrics.STAGE_DURATION и трассу"""
+    started = time.perf_counter()
+    try:
+        with speed_trace.span(name, category="engine"):
+            yield
+    finally:
+        speed_metrics.STAGE_DURATION.observe(time.perf_counter() - started, stage=name)
+
+
+# Оценка bufferbloat по росту задержки под нагрузкой, мс (шкала как у Waveform)
+BUFFERBLOAT_GRADES = ((5, "A+"), (30, "A"), (60, "B"), (200, "C"), (400, "D"))
+
+
+def bufferbloat_grade(increase):
+    for limit, grade in BUFFERBLOAT_GRADES:
+        if increase < limit:
+            return grade
+    return "F"
+
+
+class LatencyProber:
+    """Фоновое измерение задержки во время теста.
+
+    Пока идут загрузка и отдача, поток раз в interval секунд открывает
+    TCP-соединение с сервером теста. Замеры раскладываются по фазам
+    (idle/download/upload), которые переключает движок.
+    """
+
+    PHASES = ("idle", "download", "upload")
+
+    def __init__(self, host, port, interval=0.1, timeout=1.0):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.timeout = timeout
+        self.phase = "idle"
+        self.samples = {phase: [] for phase in self.PHASES}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # Адрес разрешается один раз, чтобы DNS не попадал в замеры
+        self.address = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)[0]
+        self._thread = threading.Thread(target=self._loop, name="LatencyProber", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout + self.interval)
+
+    def wait_for_idle(self, count=10, max_wait=3.0, cancel_event=None):
+        """Ожидание базовых замеров без нагрузки (прерывается cancel_event)"""
+        deadline = time.monotonic() + max_wait
+        while len(self.samples["idle"]) < count and time.monotonic() < deadline:
+            if (cancel_event or self._stop).wait(self.interval):
+                return
+
+    def _loop(self):
+        while not self._stop.is_set():
+            rtt = tcp_connect_rtt(self.address, self.timeout)
+            self.samples[self.phase].append(rtt)
+            self._stop.wait(self.interval)
+
+    def summary(self, fallback_idle=None):
+        """Задержка без нагрузки и под нагрузкой, джиттер и оценка bufferbloat"""
+        valid = {phase: [rtt for rtt in rtts if rtt is not None] for phase, rtts in self.samples.items()}
+        idle = statistics.median(valid["idle"]) if valid["idle"] else fallback_idle
+        down = statistics.median(valid["download"]) if valid["download"] else None
+        up = statistics.median(valid["upload"]) if valid["upload"] else None
+
+        loaded = valid["download"] + valid["upload"]
+        jitter = None
+        if len(loaded) > 1:
+            jitter = statistics.mean(abs(b - a) for a, b in zip(loaded, loaded[1:]))
+
+        grade = None
+        if idle is not None and (down is not None or up is not None):
+            worst = max(value for value in (down, up) if value is not None)
+            grade = bufferbloat_grade(max(0, worst - idle))
+
+        return {
+            "idle_latency": idle,
+            "loaded_latency_down": down,
+            "loaded_latency_up": up,
+            "latency_jitter": jitter,
+            "bufferbloat_grade": grade,
+        }
+
+
+# Подбор числа потоков: шаги и порог, ниже которого рост считается плато
+AUTO_THREAD_STEPS = (2, 4, 8, 16, 32)
+AUTO_TUNE_PLATEAU = 0.1  # Меньше +10% скорости на шаге — дальше не увеличиваем
+AUTO_TUNE_SECONDS = 3  # Длительность пробной передачи на каждом шаге
+
+DIRECTION_TITLES = {"download": "загрузка", "upload": "отдача"}
+
+
+def parse_threads(value):
+    """None/"server" — как задает сервер, "auto" — подбор, иначе число потоков"""
+    if value in (None, "", "server"):
+        return None
+    if value == "auto":
+        return "auto"
+    threads = int(value)
+    if threads < 1:
+        raise ValueError("Число потоков должно быть не меньше 1")
+    return threads
+
+
+class SpeedTestEngine:
+    """Тест скорости с проверкой сети и перебором серверов"""
+
+    def __init__(self, timeout=30, on_progress=None, on_server=None, ui_pauses=True,
+                 bufferbloat=False, threads=None, cancel_event=None):
+        self.timeout = timeout  # Таймаут в секундах
+        self.bufferbloat = bufferbloat  # Измерять задержку под нагрузкой
+        self.threads = parse_threads(threads)  # Параллельные потоки передачи (см. parse_threads)
+        self.servers = []  # Список серверов
+        self.current_server = None
+        self.on_progress = on_progress or _do_nothing
+        self.on_server = on_server or _do_nothing
+        self.ui_pauses = ui_pauses  # Паузы, чтобы пользователь успел прочитать статус
+        # Отмена: событие проверяется между этапами, а speedtest проверяет его во время передачи
+        self.cancel_event = cancel_event or threading.Event()
+
+    def cancel(self):
+        """Запросить отмену теста (из любого потока)"""
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise SpeedTestCancelled("⏹ Тест отменен")
+
+    def _pause(self, seconds):
+        if self.ui_pauses:
+            self.cancel_event.wait(seconds)
+        self.check_cancelled()
+
+    def check_internet_connection(self):
+        """Проверка наличия интернет-соединения"""
+        import requests
+
+        try:
+            # Быстрая проверка доступности интернета
+            requests.get("http://1.1.1.1", timeout=5)
+            requests.get("http://8.8.8.8", timeout=5)
+            return True
+        except Exception:
+            try:
+                # Попытка через Google
+                requests.get("http://www.google.com", timeout=5)
+                return True
+            except Exception:
+                return False
+
+    def get_available_servers(self):
+        """Получение списка доступных серверов"""
+        import speedtest
+
+        try:
+            self.on_progress(5, "Поиск доступных серверов...")
+
+            with _stage("server_discovery"):
+                with speed_trace.span("speedtest_config", category="engine"):
+                    st = speedtest.Speedtest(shutdown_event=self.cancel_event)
+                with speed_trace.span("get_servers", category="engine"):
+                    st.get_servers()  # Получаем все серверы
+
+                # Берем только ближайшие серверы
+                servers = st.get_closest_servers(limit=10)
+        except Exception as e:
+            self.check_cancelled()
+            raise SpeedTestError(f"Ошибка при поиске серверов: {str(e)}")
+
+        # Форматируем информацию о серверах
+        server_list = []
+        for server in servers:
+            info = {
+                'id': server['id'],
+                'name': server.get('name', 'Unknown'),
+                'country': server.get('country', 'Unknown'),
+                'sponsor': server.get('sponsor', 'Unknown'),
+                'd': server['d']
+            }
+            server_list.append(info)
+
+            # Отправляем информацию о сервере в UI
+            self.on_server(f"{info['sponsor']} - {info['name']}, {info['country']}")
+            self._pause(0.1)
+
+        self.servers = server_list
+        return server_list
+
+    @staticmethod
+    def _set_streams(st, defaults, direction, threads):
+        """Увеличить число запросов пропорционально потокам, чтобы передача не кончалась раньше времени"""
+        factor = max(1.0, threads / defaults["threads"][direction])
+        count = math.ceil(defaults["counts"][direction] * factor)
+        st.config['counts'][direction] = count
+        if direction == "upload":
+            st.config['upload_max'] = count * len(st.config['sizes']['upload'])
+
+    @staticmethod
+    def _transfer(st, direction, threads):
+        transfer = st.download if direction == "download" else st.upload
+        return transfer(threads=threads) / 1_000_000
+
+    def tune_threads(self, st, defaults, direction, progress):
+        """Короткие передачи с растущим числом потоков, пока скорость растет заметно"""
+        length = st.config['length'][direction]
+        st.config['length'][direction] = min(length, AUTO_TUNE_SECONDS)
+        best_threads, best_speed = None, 0
+        try:
+            for threads in AUTO_THREAD_STEPS:
+                self.on_progress(progress, f"Подбор числа потоков ({DIRECTION_TITLES[direction]}): {threads}...")
+                self._set_streams(st, defaults, direction, threads)
+                with speed_trace.span("tune", category="engine", direction=direction, threads=threads):
+                    speed = self._transfer(st, direction, threads)
+                self.check_cancelled()
+                if best_threads is not None and speed < best_speed * (1 + AUTO_TUNE_PLATEAU):
+                    break
+                best_threads, best_speed = threads, speed
+        finally:
+            st.config['length'][direction] = length
+        return best_threads
+
+    def measure(self, st, defaults, direction, progress):
+        """Замер скорости в одном направлении; возвращает (Мбит/с, число потоков)"""
+        threads = self.threads
+        if threads == "auto":
+            with _stage(f"{direction}_tune"):
+                threads = self.tune_threads(st, defaults, direction, progress)
+        elif threads is None:
+            threads = st.config['threads'][direction]
+        self._set_streams(st, defaults, direction, threads)
+
+        self.on_progress(progress, f"Тестирование скорости ({DIRECTION_TITLES[direction]}, потоков: {threads})...")
+        with _stage(direction):
+            speed = self._transfer(st, direction, threads)
+        # Прерванная передача возвращает неполный результат — его не используем
+        self.check_cancelled()
+        return speed, threads
+
+    def test_single_server(self, server_info):
+        """Тестирование на конкретном сервере"""
+        import speedtest
+
+        try:
+            with speed_trace.span("speedtest_config", category="engine"):
+                st = speedtest.Speedtest(shutdown_event=self.cancel_event)
+
+            # Устанавливаем таймауты
+            st.config['download_timeout'] = self.timeout
+            st.config['upload_timeout'] = self.timeout
+
+            # Используем конкретный сервер
+            with _stage("server_select"):
+                with speed_trace.span("get_servers", category="engine"):
+                    st.get_servers(servers=[server_info['id']])
+                with speed_trace.span("get_best_server", category="engine"):
+                    st.get_best_server()
+
+            self.current_server = server_info
+            # Параметры сервера до изменений: от них считается число запросов для других потоков
+            defaults = {
+                "threads": dict(st.config['threads']),
+                "counts": dict(st.config['counts']),
+            }
+
+            self.check_cancelled()
+
+            prober = None
+            try:
+                if self.bufferbloat:
+                    prober = LatencyProber(*parse_target(st.best['host'], default_port=80))
+                    self.on_progress(27, "Измерение задержки без нагрузки...")
+                    prober.start()
+                    prober.wait_for_idle(cancel_event=self.cancel_event)
+                    self.check_cancelled()
+
+                # Тестируем с прогрессом
+                if prober:
+                    prober.phase = "download"
+                download, download_threads = self.measure(st, defaults, "download", 30)
+
+                if prober:
+                    prober.phase = "upload"
+                upload, upload_threads = self.measure(st, defaults, "upload", 60)
+            finally:
+                if prober:
+                    prober.stop()
+
+            self.on_progress(90, "Измерение ping...")
+            ping = st.results.ping
+
+            extra = prober.summary(fallback_idle=ping) if prober else {}
+            # Конфигурация потоков сохраняется с результатом, чтобы замеры были сравнимы
+            extra.update(
+                threads_mode="auto" if self.threads == "auto" else "fixed" if self.threads else "server",
+                download_threads=download_threads,
+                upload_threads=upload_threads,
+            )
+            return ping, download, upload, extra
+
+        except SpeedTestCancelled:
+            raise
+        except Exception as e:
+            self.check_cancelled()
+            raise SpeedTestError(f"Сервер {server_info['sponsor']}: {str(e)}")
+
+    def run(self):
+        """Полный тест; возвращает SpeedTestResult или бросает SpeedTestError"""
+        try:
+            with _stage("total"):
+                result = self._run()
+        except SpeedTestCancelled:
+            speed_metrics.TESTS.inc(result="cancelled")
+            raise
+        except Exception:
+            speed_metrics.TESTS.inc(result="failure")
+            raise
+
+        speed_metrics.TESTS.inc(result="success")
+        speed_metrics.LAST_DOWNLOAD.set(result.download)
+        speed_metrics.LAST_UPLOAD.set(result.upload)
+        speed_metrics.LAST_PING.set(result.ping)
+        speed_metrics.LAST_SUCCESS.set(time.time())
+        return result
+
+    def _run(self):
+        # Шаг 1: Проверка интернет-соединения
+        self.on_progress(0, "Проверка интернет-соединения...")
+
+        with _stage("connectivity"):
+            connected = self.check_internet_connection()
+        self.check_cancelled()
+        if not connected:
+            raise SpeedTestError("❌ Нет интернет-соединения. Проверьте подключение к сети.")
+
+        self.on_progress(10, "✅ Интернет-соединение активно")
+        self._pause(0.5)
+
+        # Шаг 2: Получение доступных серверов
+        self.get_available_servers()
+
+        if not self.servers:
+            raise SpeedTestError("❌ Не найдено доступных серверов для тестирования")
+
+        self.on_progress(20, f"✅ Найдено {len(self.servers)} серверов")
+        self._pause(0.5)
+
+        # Шаг 3: Попытка тестирования на разных серверах
+        last_error = ""
+
+        for i, server in enumerate(self.servers[:3]):  # Пробуем только 3 лучших сервера
+            try:
+                self.on_progress(25, f"Попытка {i+1}/3: {server['sponsor']}...")
+
+                ping, download, upload, extra = self.test_single_server(server)
+
+                # Успешный тест
+                if i > 0:
+                    speed_metrics.SERVER_FALLBACKS.inc()
+                self.on_progress(100, "✅ Тест успешно завершен!")
+                return SpeedTestResult(ping, download, upload, server['sponsor'], server['country'], extra)
+
+            except SpeedTestCancelled:
+                raise
+            except SpeedTestError as e:
+                speed_metrics.SERVER_FAILURES.inc()
+                last_error = str(e)
+                self.on_progress(25 + i*10, f"⚠️  Сервер {server['sponsor']} не доступен, пробую другой...")
+                self.cancel_event.wait(1)  # Пауза между попытками
+                self.check_cancelled()
+
+        # Если все попытки не удались
+        raise SpeedTestError(f"❌ Все серверы недоступны. Последняя ошибка: {last_error}")
@@ -0,0 +1,92 @@
+"""Потоковый экспорт истории тестов в CSV, JSON Lines и Parquet.
+
+Строки читаются из БД порциями и сразу записываются в файл, поэтому
+расход памяти не зависит от размера истории. Parquet требует pyarrow.
+"""
+import csv
+import json
+import sys
+
+FORMATS = ("csv", "jsonl", "parquet")
+_EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl", ".parquet": "parquet"}
+
+
+class ExportError(Exception):
+    """Ошибка экспорта с сообщением для пользователя"""
+
+
+def guess_format(path):
+    """Формат по расширению файла"""
+    lowered = str(path).lower()
+    for extension, fmt in _EXTENSIONS.items():
+        if lowered.endswith(extension):
+            return fmt
+    raise ExportError(f"Не удалось определить формат по имени файла: {path} (укажите {', '.join(FORMATS)})")
+
+
+def _write_csv(chunks, columns, stream):
+    writer = csv.writer(stream)
+    writer.writerow(columns)
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def _write_jsonl(chunks, columns, stream):
+    count = 0
+    for rows in chunks:
+        stream.writelines(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows
+        )
+        count += len(rows)
+    return count
+
+
+def _write_parquet(chunks, columns, column_types, path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Для экспорта в Parquet установите pyarrow: pip install pyarrow")
+
+    # Схема по объявленным типам SQLite, чтобы порции не расходились по типам
+    type_map = {"INTEGER": pa.int64(), "REAL": pa.float64()}
+    schema = pa.schema([(name, type_map.get(column_types.get(name), pa.string())) for name in columns])
+
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            arrays = []
+            for field, column in zip(schema, zip(*rows)):
+                if pa.types.is_string(field.type):
+                    column = [None if value is None else str(value) for value in column]
+                arrays.append(pa.array(column, type=field.type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    return count
+
+
+def export_tests(db, path, fmt=None, since=None, until=None, server=None,
+                 include_failed=False, chunk_size=10000):
+    """Экспорт tests в файл (или "-" для stdout); возвращает число строк"""
+    fmt = fmt or guess_format(path)
+    if fmt not in FORMATS:
+        raise ExportError(f"Неизвестный формат: {fmt}")
+
+    chunks = db.iter_tests(since, until, server, include_failed, chunk_size)
+    columns = next(chunks)
+    try:
+        if fmt == "parquet":
+            if path == "-":
+                raise ExportError("Parquet нельзя выводить в stdout, укажите файл")
+            return _write_parquet(chunks, columns, db.get_column_types(), path)
+
+        writer = _write_csv if fmt == "csv" else _write_jsonl
+        if path == "-":
+            return writer(chunks, columns, sys.stdout)
+        with open(path, "w", newline="", encoding="utf-8") as stream:
+            return writer(chunks, columns, stream)
+    finally:
+        chunks.close()
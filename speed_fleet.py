@@ -0,0 +1,216 @@
+"""Сбор результатов с множества проб в одну центральную БД.
+
+Источник — БД пробы (internet_speed_enhanced.db) или файл экспорта
+(CSV, JSON Lines, Parquet из speed_export). Для каждой пробы в центральной
+БД хранится отметка high_water — последний взятый id исходной таблицы
+tests, — поэтому повторный сбор читает только новые строки. Порция строк
+и новая отметка записываются одной транзакцией: прерванный сбор не
+приводит к дублям. Если id источника меньше отметки (БД пробы создана
+заново), сбор с него останавливается с ошибкой, а не молча читает 0 строк.
+
+Первый сбор с пробы загружает ее историю: детекторы деградаций на ней
+обучаются, но найденное не сообщается как новые события.
+
+Источники читаются параллельно в потоках, запись в центральную БД идет
+из одного потока.
+"""
+import csv
+import json
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from speed_export import ExportError, guess_format
+from speed_storage import DatabaseManager
+
+_COLUMN_TYPES = {"id": "INTEGER", "success": "INTEGER", "ping": "REAL", "download": "REAL", "upload": "REAL",
+                 **DatabaseManager.EXTRA_COLUMNS}
+_CONVERTERS = {"INTEGER": int, "REAL": float}
+
+
+class AggregationError(Exception):
+    """Ошибка сбора с сообщением для пользователя"""
+
+
+def probe_name(path):
+    """Имя пробы по пути: имя файла без расширения, а для файла БД по умолчанию — имя каталога"""
+    absolute = os.path.abspath(path)
+    stem = os.path.splitext(os.path.basename(absolute))[0]
+    if stem == os.path.splitext(DatabaseManager.DEFAULT_DB_FILE)[0]:
+        return os.path.basename(os.path.dirname(absolute)) or stem
+    return stem
+
+
+def parse_source(text):
+    """"name=path" или "path" -> (имя пробы, путь)"""
+    name, separator, path = text.partition("=")
+    if separator and name and not os.path.exists(text):
+        return name, path
+    return probe_name(text), text
+
+
+def _check_high_water(path, max_id, since_id):
+    if since_id and (max_id or 0) < since_id:
+        raise AggregationError(
+            f"{path}: последний id {max_id or 0} меньше уже собранного {since_id} — "
+            "БД пробы создана заново? Соберите ее под новым именем пробы (name=path)"
+        )
+
+
+def _read_database(path, since_id, chunk_size):
+    if not os.path.exists(path):
+        raise AggregationError(f"Файл не найден: {path}")
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        _check_high_water(path, conn.execute("SELECT MAX(id) FROM tests").fetchone()[0], since_id)
+        cursor = conn.execute("SELECT * FROM tests WHERE id > ? ORDER BY id", (since_id,))
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [dict(zip(columns, row)) for row in rows]
+    finally:
+        conn.close()
+
+
+def _convert(record):
+    """Значения из текстового экспорта -> типы колонок tests"""
+    for column, value in record.items():
+        if value == "" or value is None:
+            record[column] = None
+        elif column in _COLUMN_TYPES and isinstance(value, str):
+            converter = _CONVERTERS.get(_COLUMN_TYPES[column])
+            if converter:
+                record[column] = converter(float(value)) if converter is int else converter(value)
+    return record
+
+
+def _chunked(path, records, since_id, chunk_size):
+    chunk = []
+    max_id = None
+    for record in records:
+        record = _convert(record)
+        if record.get("id") is None:
+            raise AggregationError("В экспорте нет колонки id — выгрузите историю заново через speed_cli export")
+        max_id = record["id"] if max_id is None else max(max_id, record["id"])
+        if record["id"] <= since_id:
+            continue
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+    _check_high_water(path, max_id, since_id)
+
+
+def _read_export(path, fmt, since_id, chunk_size):
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise AggregationError("Для чтения Parquet установите pyarrow: pip install pyarrow")
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunk_size)
+        records = (record for batch in batches for record in batch.to_pylist())
+        yield from _chunked(path, records, since_id, chunk_size)
+        return
+
+    with open(path, newline="", encoding="utf-8") as stream:
+        if fmt == "csv":
+            records = csv.DictReader(stream)
+        else:
+            records = (json.loads(line) for line in stream if line.strip())
+        yield from _chunked(path, records, since_id, chunk_size)
+
+
+def read_source(path, since_id=0, chunk_size=10000):
+    """Порции (списки словарей) строк tests источника с id > since_id, по возрастанию id"""
+    if path.lower().endswith((".db", ".sqlite", ".sqlite3")):
+        return _read_database(path, since_id, chunk_size)
+    try:
+        fmt = guess_format(path)
+    except ExportError as e:
+        raise AggregationError(str(e))
+    return _read_export(path, fmt, since_id, chunk_size)
+
+
+def _to_row(record, probe):
+    extra = {column: record.get(column) for column in DatabaseManager.EXTRA_COLUMNS if record.get(column) is not None}
+    # Строки, уже собранные с другой центральной БД, сохраняют исходную пробу
+    extra["probe"] = extra.get("probe") or probe
+    return DatabaseManager.make_row(
+        record.get("ping"), record.get("download"), record.get("upload"),
+        record.get("server_name") or "", record.get("server_country") or "",
+        bool(record.get("success", 1)), timestamp=record.get("timestamp"), **extra
+    )
+
+
+_DONE = object()
+
+
+def aggregate(db, sources, workers=4, chunk_size=10000, on_progress=None):
+    """Дозаписать в db новые строки из sources [(имя пробы, путь)].
+
+    Возвращает {имя пробы: число новых строк или текст ошибки}. Ошибка
+    одного источника не прерывает сбор с остальных.
+    """
+    names = [name for name, _ in sources]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise AggregationError(f"Несколько источников с одним именем пробы: {', '.join(sorted(duplicates))} "
+                               "(задайте имена явно: name=path)")
+
+    # Очередь ограничена, чтобы быстрые читатели не накапливали порции в памяти
+    chunks = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    results = {}
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(name, path, since_id):
+        try:
+            for chunk in read_source(path, since_id, chunk_size):
+                if not put((name, chunk)):
+                    return
+            put((name, _DONE))
+        except Exception as e:
+            put((name, e))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="aggregate") as executor:
+        # Отметки читаются заранее: по ним же видно, какие пробы собираются впервые
+        high_water = {name: db.get_high_water(name) for name, _ in sources}
+        for name, path in sources:
+            results[name] = 0
+            executor.submit(read, name, path, high_water[name])
+
+        remaining = len(sources)
+        try:
+            while remaining:
+                name, item = chunks.get()
+                if item is _DONE or isinstance(item, Exception):
+                    remaining -= 1
+                    if isinstance(item, AggregationError):
+                        results[name] = str(item)
+                    elif isinstance(item, Exception):
+                        results[name] = f"{type(item).__name__}: {item}"
+                    if on_progress:
+                        on_progress(name, results[name], True)
+                    continue
+                rows = [_to_row(record, name) for record in item]
+                db.merge_tests(name, rows, item[-1]["id"], record=high_water[name] > 0)
+                results[name] += len(rows)
+                if on_progress:
+                    on_progress(name, results[name], False)
+        finally:
+            stop.set()
+    return results
@@ -1,165 +1,206 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import logging
+import os
 import sys
-import speedtest
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-from datetime import datetime, timedelta
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
-import sqlite3
-import time
-import requests
 import threading
+import math
+import weakref
+import html
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from speed_engine import SpeedTestCancelled, SpeedTestEngine, SpeedTestError
+from speed_export import ExportError, export_tests, guess_format
+import speed_trace
+from speed_scheduler import TestScheduler, parse_schedule
+from speed_storage import DatabaseManager
+
+# pandas и matplotlib загружаются лениво: при первой загрузке истории
+# и при первом открытии вкладки с графиками
+_IMPORT_FINISHED = time.perf_counter()
+
+log = logging.getLogger(__name__)
+
+# Варианты автотеста в интерфейсе: подпись -> расписание для parse_schedule
+AUTO_TEST_SCHEDULES = {
+    "Выключен": None,
+    "Каждые 15 минут": "15m",
+    "Каждый час": "1h",
+    "Каждые 6 часов": "6h",
+}
+SCHEDULED_TEST_TIMEOUT = 600  # Сколько планировщик ждет завершения теста, секунды
+CANCEL_TIMEOUT = 30  # Сколько ждать остановки отмененного теста, секунды
+SHUTDOWN_TIMEOUT_MS = 3000  # Сколько окно ждет фоновые потоки при закрытии до скрытия
+THREAD_MODES = {
+    "Потоки: как у сервера": None,
+    "Потоки: авто": "auto",
+    "Потоки: 4": 4,
+    "Потоки: 8": 8,
+    "Потоки: 16": 16,
+}
+
+
+def load_matplotlib():
+    """Ленивая загрузка matplotlib; возвращает классы Figure и FigureCanvas"""
+    import matplotlib.style
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+    
+    if not getattr(load_matplotlib, "styled", False):
+        matplotlib.style.use('seaborn-v0_8-darkgrid')
+        load_matplotlib.styled = True
+    return Figure, FigureCanvas
+
+
+class HistoryLoader(QThread):
+    """Фоновая загрузка истории тестов, перцентилей для шкал спидометров и сводки зондов"""
+    loaded = pyqtSignal(object, object, object, object)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, db, days):
+        super().__init__()
+        self.db = db
+        self.days = days
+    
+    def run(self):
+        try:
+            with speed_trace.profiled(), speed_trace.span("load_data.query", days=self.days):
+                df = self.db.get_tests(self.days)
+                percentiles = {
+                    metric: self.db.get_percentile(metric, 0.99)
+                    for metric in DatabaseManager.HISTOGRAM_METRICS
+                }
+                probes = self.db.get_probe_summary(self.days)
+                anomalies = self.db.get_anomalies(self.days)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.loaded.emit(df, percentiles, probes, anomalies)
 
-plt.style.use('seaborn-v0_8-darkgrid')
 
 class ImprovedSpeedTestWorker(QThread):
     """Улучшенный поток для теста скорости с обработкой таймаутов"""
     progress = pyqtSignal(int, str)
-    finished = pyqtSignal(float, float, float, str, str)
+    finished = pyqtSignal(object)  # SpeedTestResult
     error = pyqtSignal(str)
+    cancelled = pyqtSignal()
     server_info = pyqtSignal(str)
     
-    def __init__(self):
+    def __init__(self, bufferbloat=False, threads=None):
         super().__init__()
-        self.timeout = 30  # Таймаут в секундах
-        self.servers = []  # Список серверов
-        self.current_server = None
+        self.engine = SpeedTestEngine(
+            timeout=30,
+            on_progress=self.progress.emit,
+            on_server=self.server_info.emit,
+            bufferbloat=bufferbloat,
+            threads=threads
+        )
     
-    def check_internet_connection(self):
-        """Проверка наличия интернет-соединения"""
-        try:
-            # Быстрая проверка доступности интернета
-            requests.get("http://1.1.1.1", timeout=5)
-            requests.get("http://8.8.8.8", timeout=5)
-            return True
-        except:
-            try:
-                # Попытка через Google
-                requests.get("http://www.google.com", timeout=5)
-                return True
-            except:
-                return False
-    
-    def get_available_servers(self):
-        """Получение списка доступных серверов"""
-        try:
-            self.progress.emit(5, "Поиск доступных серверов...")
-            
-            st = speedtest.Speedtest()
-            st.get_servers()  # Получаем все серверы
-            
-            # Берем только ближайшие серверы
-            servers = st.get_closest_servers(limit=10)
-            
-            # Форматируем информацию о серверах
-            server_list = []
-            for server in servers:
-                info = {
-                    'id': server['id'],
-                    'name': server.get('name', 'Unknown'),
-                    'country': server.get('country', 'Unknown'),
-                    'sponsor': server.get('sponsor', 'Unknown'),
-                    'd': server['d']
-                }
-                server_list.append(info)
-                
-                # Отправляем информацию о сервере в UI
-                server_text = f"{info['sponsor']} - {info['name']}, {info['country']}"
-                self.server_info.emit(server_text)
-                time.sleep(0.1)  # Небольшая пауза для UI
-            
-            self.servers = server_list
-            return True
-            
-        except Exception as e:
-            self.error.emit(f"Ошибка при поиске серверов: {str(e)}")
-            return False
-    
-    def test_single_server(self, server_info):
-        """Тестирование на конкретном сервере"""
-        try:
-            st = speedtest.Speedtest()
-            
-            # Устанавливаем таймауты
-            st.config['download_timeout'] = self.timeout
-            st.config['upload_timeout'] = self.timeout
-            
-            # Используем конкретный сервер
-            server = [server_info['id']]
-            st.get_servers(servers=server)
-            st.get_best_server()
-            
-            self.current_server = server_info
-            
-            # Тестируем с прогрессом
-            self.progress.emit(30, "Тестирование скорости загрузки...")
-            download = st.download() / 1_000_000
-            
-            self.progress.emit(60, "Тестирование скорости отдачи...")
-            upload = st.upload() / 1_000_000
-            
-            self.progress.emit(90, "Измерение ping...")
-            ping = st.results.ping
-            
-            return ping, download, upload
-            
-        except Exception as e:
-            raise Exception(f"Сервер {server_info['sponsor']}: {str(e)}")
+    def cancel(self):
+        """Отмена из GUI-потока: передача останавливается, сокеты и потоки speedtest закрываются"""
+        self.engine.cancel()
     
     def run(self):
         try:
-            # Шаг 1: Проверка интернет-соединения
-            self.progress.emit(0, "Проверка интернет-соединения...")
-            
-            if not self.check_internet_connection():
-                self.error.emit("❌ Нет интернет-соединения. Проверьте подключение к сети.")
-                return
-            
-            self.progress.emit(10, "✅ Интернет-соединение активно")
-            time.sleep(0.5)
-            
-            # Шаг 2: Получение доступных серверов
-            if not self.get_available_servers():
-                return
-            
-            if not self.servers:
-                self.error.emit("❌ Не найдено доступных серверов для тестирования")
-                return
-            
-            self.progress.emit(20, f"✅ Найдено {len(self.servers)} серверов")
-            time.sleep(0.5)
-            
-            # Шаг 3: Попытка тестирования на разных серверах
-            last_error = ""
-            
-            for i, server in enumerate(self.servers[:3]):  # Пробуем только 3 лучших сервера
-                try:
-                    self.progress.emit(25, f"Попытка {i+1}/3: {server['sponsor']}...")
-                    
-                    ping, download, upload = self.test_single_server(server)
-                    
-                    # Успешный тест
-                    self.progress.emit(100, "✅ Тест успешно завершен!")
-                    self.finished.emit(
-                        ping, download, upload,
-                        server['sponsor'],
-                        server['country']
-                    )
-                    return
-                    
-                except Exception as e:
-                    last_error = str(e)
-                    self.progress.emit(25 + i*10, f"⚠️  Сервер {server['sponsor']} не доступен, пробую другой...")
-                    time.sleep(1)  # Пауза между попытками
-            
-            # Если все попытки не удались
-            self.error.emit(f"❌ Все серверы недоступны. Последняя ошибка: {last_error}")
-            
+            with speed_trace.profiled(), speed_trace.span("speed_test"):
+                result = self.engine.run()
+        except SpeedTestCancelled:
+            self.cancelled.emit()
+            return
+        except SpeedTestError as e:
+            self.error.emit(str(e))
+            return
         except Exception as e:
             self.error.emit(f"❌ Неожиданная ошибка: {str(e)}")
+            return
+        
+        self.finished.emit(result)
+
+GAUGE_MAX_FPS = 60  # Ограничение частоты кадров анимации спидометров
+
+
+def export_path(path, fmt):
+    """Путь с расширением формата fmt: известное расширение заменяется, иначе добавляется"""
+    try:
+        if guess_format(path) == fmt:
+            return path
+        path = os.path.splitext(path)[0]
+    except ExportError:
+        pass
+    return f"{path}.{fmt}"
+
+
+def nice_scale(value, minimum=10):
+    """Округление верхней границы шкалы до «красивого» числа (1, 2, 2.5, 5 × 10^n)"""
+    if not value or value <= minimum:
+        return minimum
+    magnitude = 10 ** math.floor(math.log10(value))
+    for step in (1, 2, 2.5, 5, 10):
+        if value <= step * magnitude:
+            return int(step * magnitude)
+    return int(10 * magnitude)
+
+
+class GaugeAnimator(QObject):
+    """Общие часы анимации для всех спидометров.
+
+    Один таймер на все виджеты: сдвиг стрелки считается по реально
+    прошедшему времени, поэтому скорость анимации не зависит от дрожания
+    таймера. Таймер останавливается, когда анимировать нечего.
+    """
+    _instance = None
+
+    def __init__(self, max_fps=GAUGE_MAX_FPS, time_constant=0.12):
+        super().__init__()
+        self.time_constant = time_constant  # Секунды до ~63% пути к цели
+        self._widgets = weakref.WeakSet()
+        self._clock = QElapsedTimer()
+        self._last_tick = 0
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.timeout.connect(self._tick)
+        self.set_max_fps(max_fps)
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def set_max_fps(self, max_fps):
+        """Установка ограничения FPS (применяется сразу)"""
+        self.max_fps = max(1, int(max_fps))
+        self._timer.setInterval(math.ceil(1000 / self.max_fps))
+
+    def animate(self, widget):
+        """Поставить виджет в очередь анимации.
+
+        Повторные вызовы до следующего кадра ничего не добавляют: виджет
+        просто догоняет свое последнее целевое значение.
+        """
+        self._widgets.add(widget)
+        if not self._timer.isActive():
+            self._clock.start()
+            self._last_tick = 0
+            self._timer.start()
+
+    def _tick(self):
+        now = self._clock.elapsed()
+        dt = (now - self._last_tick) / 1000
+        self._last_tick = now
+        alpha = 1 - math.exp(-dt / self.time_constant) if dt > 0 else 0
+        
+        for widget in list(self._widgets):
+            if not widget.advance_animation(alpha):
+                self._widgets.discard(widget)
+        
+        if not self._widgets:
+            self._timer.stop()
+
 
 class SpeedometerWidget(QWidget):
     """Виджет спидометра"""
@@ -167,34 +208,68 @@ class SpeedometerWidget(QWidget):
         super().__init__()
         self.title = title
         self.max_value = max_value
+        self.default_max_value = max_value
         self.unit = unit
         self.value = 0
         self.target_value = 0
-        self.animation_timer = QTimer()
-        self.animation_timer.timeout.connect(self.animate_value)
-        self.animation_speed = 5  # Скорость анимации
+        self._dial_cache = None
+        self._dial_cache_key = None
         
+    def set_max_value(self, max_value):
+        """Смена диапазона шкалы; циферблат перерисовывается только при изменении.
+
+        Значение не обрезается: за пределами шкалы упирается в край только стрелка.
+        """
+        if max_value == self.max_value:
+            return
+        self.max_value = max_value
+        self._dial_cache = None
+        self.update()
+    
     def set_value(self, value, animate=True):
-        self.target_value = min(value, self.max_value)
+        self.target_value = value
         if not animate:
             self.value = self.target_value
             self.update()
         else:
-            self.animation_timer.start(16)  # ~60 FPS
+            GaugeAnimator.instance().animate(self)
     
-    def animate_value(self):
+    def advance_animation(self, alpha):
+        """Шаг анимации; возвращает False, когда стрелка достигла цели"""
         diff = self.target_value - self.value
         if abs(diff) < 0.1:
             self.value = self.target_value
-            self.animation_timer.stop()
-        else:
-            self.value += diff / self.animation_speed
+            self.update()
+            return False
+        self.value += diff * alpha
         self.update()
+        return True
     
-    def paintEvent(self, event):
-        painter = QPainter(self)
+    def resizeEvent(self, event):
+        self._dial_cache = None
+        super().resizeEvent(event)
+    
+    def dial_pixmap(self):
+        """Статичная часть спидометра (фон, зоны, деления, заголовок), закэшированная в QPixmap"""
+        key = (self.width(), self.height(), self.max_value, self.devicePixelRatioF())
+        if self._dial_cache is not None and self._dial_cache_key == key:
+            return self._dial_cache
+        
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(int(self.width() * ratio), int(self.height() * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        
+        painter = QPainter(pixmap)
         painter.setRenderHint(QPainter.Antialiasing)
+        self.paint_dial(painter)
+        painter.end()
         
+        self._dial_cache = pixmap
+        self._dial_cache_key = key
+        return pixmap
+    
+    def paint_dial(self, painter):
         size = min(self.width(), self.height()) - 20
         center = QPoint(self.width() // 2, self.height() // 2)
         radius = size // 2
@@ -255,8 +330,24 @@ class SpeedometerWidget(QWidget):
         
         painter.restore()
         
-        # Стрелка
-        angle = 135 + (self.value / self.max_value) * 270
+        # Заголовок
+        painter.setFont(QFont("Arial", 12, QFont.Bold))
+        painter.setPen(QPen(Qt.darkBlue))
+        painter.drawText(QRectF(0, 10, self.width(), 30),
+                        Qt.AlignCenter,
+                        self.title)
+    
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.drawPixmap(0, 0, self.dial_pixmap())
+        
+        size = min(self.width(), self.height()) - 20
+        center = QPoint(self.width() // 2, self.height() // 2)
+        radius = size // 2
+        
+        # Стрелка (значение за пределами шкалы прижимает ее к краю)
+        angle = 135 + min(max(self.value / self.max_value, 0), 1) * 270
         painter.save()
         painter.translate(center)
         painter.rotate(angle)
@@ -297,67 +388,154 @@ class SpeedometerWidget(QWidget):
         painter.drawText(QRectF(center.x() - 50, center.y() + 40, 100, 30),
                         Qt.AlignCenter,
                         f"{self.value:.1f} {self.unit}")
+
+class ToastNotifier(QObject):
+    """Немодальные уведомления: сообщение в трее или всплывающая плашка в окне.
+
+    Уведомления не чаще одного раза в MIN_INTERVAL_MS; пришедшие за это
+    время уведомления с одинаковым заголовком объединяются в одно.
+    """
+    MIN_INTERVAL_MS = 3000
+    DISPLAY_MS = 6000
+    MAX_LINES = 8
+    
+    def __init__(self, window):
+        super().__init__(window)
+        self.window = window
+        self.pending = OrderedDict()  # заголовок -> список сообщений
+        self.last_shown = QElapsedTimer()
+        
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush)
+        
+        # Плашка в правом нижнем углу окна
+        self.toast = QLabel(window)
+        self.toast.setWordWrap(True)
+        self.toast.setMaximumWidth(420)
+        self.toast.setStyleSheet("""
+            QLabel {
+                background-color: rgba(40, 50, 70, 230);
+                color: white;
+                padding: 12px;
+                border-radius: 8px;
+                font-size: 12px;
+            }
+        """)
+        self.toast.hide()
+        self.toast.mousePressEvent = lambda event: self.toast.hide()
+        self.hide_timer = QTimer(self)
+        self.hide_timer.setSingleShot(True)
+        self.hide_timer.timeout.connect(self.toast.hide)
+        
+        # Трей используется, когда окно неактивно (например, при автотестах)
+        self.tray = None
+        if QSystemTrayIcon.isSystemTrayAvailable():
+            icon = QIcon.fromTheme("network-wireless", window.style().standardIcon(QStyle.SP_ComputerIcon))
+            self.tray = QSystemTrayIcon(icon, self)
+            self.tray.setToolTip("Internet Speed Monitor")
+            self.tray.activated.connect(lambda reason: (self.window.showNormal(), self.window.activateWindow()))
+            self.tray.show()
+    
+    def notify(self, title, message):
+        messages = self.pending.setdefault(title, [])
+        if message not in messages:
+            messages.append(message)
+        if not self.flush_timer.isActive():
+            elapsed = self.last_shown.elapsed() if self.last_shown.isValid() else self.MIN_INTERVAL_MS
+            self.flush_timer.start(max(0, self.MIN_INTERVAL_MS - elapsed))
+    
+    def flush(self):
+        if not self.pending:
+            return
         
-        # Заголовок
-        painter.setFont(QFont("Arial", 12, QFont.Bold))
-        painter.setPen(QPen(Qt.darkBlue))
-        painter.drawText(QRectF(0, 10, self.width(), 30),
-                        Qt.AlignCenter,
-                        self.title)
+        title, messages = self.pending.popitem(last=False)
+        if len(messages) > 1:
+            title = f"{title} (×{len(messages)})"
+        lines = "\n".join(messages).splitlines()
+        if len(lines) > self.MAX_LINES:
+            lines = lines[-self.MAX_LINES:]
+        self.show(title, "\n".join(lines))
+        
+        self.last_shown.start()
+        if self.pending:
+            self.flush_timer.start(self.MIN_INTERVAL_MS)
+    
+    def show(self, title, text):
+        if self.tray is not None and not self.window.isActiveWindow():
+            self.tray.showMessage(title, text, QSystemTrayIcon.Information, self.DISPLAY_MS)
+            return
+        
+        self.toast.setText(f"<b>{html.escape(title)}</b><br>{html.escape(text).replace(chr(10), '<br>')}")
+        self.toast.adjustSize()
+        margin = 20
+        self.toast.move(self.window.width() - self.toast.width() - margin,
+                        self.window.height() - self.toast.height() - margin - self.window.statusBar().height())
+        self.toast.raise_()
+        self.toast.show()
+        self.hide_timer.start(self.DISPLAY_MS)
+
+class ExportWorker(QThread):
+    """Фоновый экспорт истории в файл"""
+    finished = pyqtSignal(int, str)
+    error = pyqtSignal(str)
+    
+    def __init__(self, db, path, fmt, since=None, server=None):
+        super().__init__()
+        self.db = db
+        self.path = path
+        self.fmt = fmt
+        self.since = since
+        self.server = server
+    
+    def run(self):
+        try:
+            count = export_tests(self.db, self.path, self.fmt, since=self.since, server=self.server)
+        except (ExportError, OSError) as e:
+            self.error.emit(str(e))
+            return
+        except Exception as e:
+            self.error.emit(f"неожиданная ошибка: {str(e)}")
+            return
+        self.finished.emit(count, self.path)
 
 class EnhancedMainWindow(QMainWindow):
+    scheduled_test_requested = pyqtSignal(object)
+    cancel_requested = pyqtSignal()
+    
     def __init__(self):
         super().__init__()
-        self.db = self.DatabaseManager()
+        self.startup_timings = {"import": (_IMPORT_FINISHED - _IMPORT_STARTED) * 1000}
+        started = time.perf_counter()
+        
+        # Схема БД создается в фоновом потоке при первой загрузке истории
+        self.db = DatabaseManager(lazy=True)
+        self.history_df = None
+        self.probe_summary = None
+        self.anomalies = []
+        self.history_loader = None
+        self.reload_pending = False
+        self.first_paint_done = False
+        self.startup_reported = False
+        self.scheduler = None
+        self.scheduled_request = None
+        self.scheduled_test_requested.connect(self.start_scheduled_test)
+        self.cancel_requested.connect(self.cancel_test)
+        self.pending_scheduled = None  # Автотест, ждущий остановки вытесняемого теста
+        self.worker = None
+        self.retired_workers = []  # Не остановившиеся вовремя потоки: держим ссылки до их завершения
+        self.export_worker = None
+        self.test_started = None
+        self.shutdown_timer = None
+        self.error_dialog = None
+        self.error_details = None
         self.init_ui()
+        self.notifier = ToastNotifier(self)
         self.test_in_progress = False
-        self.load_data()
+        self.startup_timings["window"] = (time.perf_counter() - started) * 1000
         
-        # Автоматический тест при запуске (опционально)
-        # QTimer.singleShot(1000, self.run_speed_test)
-    
-    class DatabaseManager:
-        def __init__(self):
-            self.db_file = "internet_speed_enhanced.db"
-            self.init_db()
-        
-        def init_db(self):
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS tests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME,
-                    ping REAL,
-                    download REAL,
-                    upload REAL,
-                    server_name TEXT,
-                    server_country TEXT,
-                    success INTEGER DEFAULT 1
-                )
-            ''')
-            conn.commit()
-            conn.close()
-        
-        def save_test(self, ping, download, upload, server_name="", server_country="", success=True):
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO tests (timestamp, ping, download, upload, server_name, server_country, success)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (datetime.now(), ping, download, upload, server_name, server_country, 1 if success else 0))
-            conn.commit()
-            conn.close()
-        
-        def get_tests(self, days=None):
-            conn = sqlite3.connect(self.db_file)
-            query = "SELECT * FROM tests WHERE success = 1 ORDER BY timestamp DESC"
-            if days:
-                cutoff = datetime.now() - timedelta(days=days)
-                query = f"SELECT * FROM tests WHERE success = 1 AND timestamp >= '{cutoff}' ORDER BY timestamp DESC"
-            df = pd.read_sql_query(query, conn)
-            conn.close()
-            return df
+        # История загружается асинхронно, уже после показа окна
+        QTimer.singleShot(0, self.load_data)
     
     def init_ui(self):
         self.setWindowTitle("🌐 Internet Speed Monitor Pro v2.0")
@@ -416,6 +594,17 @@ class EnhancedMainWindow(QMainWindow):
         """)
         layout.addWidget(self.test_btn)
         
+        # Отмена идущего теста
+        self.cancel_btn = QPushButton("⏹ Отменить")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_test)
+        layout.addWidget(self.cancel_btn)
+        
+        # Экспорт истории
+        self.export_btn = QPushButton("💾 Экспорт")
+        self.export_btn.clicked.connect(self.export_history)
+        layout.addWidget(self.export_btn)
+        
         # Выбор сервера
         server_label = QLabel("Сервер:")
         layout.addWidget(server_label)
@@ -433,6 +622,27 @@ class EnhancedMainWindow(QMainWindow):
         self.period_combo.currentIndexChanged.connect(self.load_data)
         layout.addWidget(self.period_combo)
         
+        # Автоматические тесты по расписанию
+        auto_label = QLabel("Автотест:")
+        layout.addWidget(auto_label)
+        
+        self.auto_test_combo = QComboBox()
+        self.auto_test_combo.addItems(list(AUTO_TEST_SCHEDULES))
+        self.auto_test_combo.currentIndexChanged.connect(self.set_auto_test)
+        layout.addWidget(self.auto_test_combo)
+        
+        # Задержка под нагрузкой
+        self.bufferbloat_check = QCheckBox("Bufferbloat")
+        self.bufferbloat_check.setToolTip("Измерять задержку во время загрузки и отдачи")
+        layout.addWidget(self.bufferbloat_check)
+        
+        # Параллельные потоки передачи
+        self.threads_combo = QComboBox()
+        self.threads_combo.addItems(list(THREAD_MODES))
+        self.threads_combo.setToolTip("Число параллельных потоков загрузки и отдачи;\n"
+                                      "«авто» увеличивает его, пока растет скорость")
+        layout.addWidget(self.threads_combo)
+        
         layout.addStretch()
         
         # Индикатор сети
@@ -446,6 +656,8 @@ class EnhancedMainWindow(QMainWindow):
     
     def check_network_status(self):
         """Проверка статуса сети"""
+        import requests
+        
         try:
             response = requests.get("http://1.1.1.1", timeout=3)
             if response.status_code < 400:
@@ -512,19 +724,17 @@ class EnhancedMainWindow(QMainWindow):
         # Вкладки
         self.tab_widget = QTabWidget()
         
+        # Графики создаются при первом открытии вкладки
+        self.speed_figure = self.speed_canvas = None
+        self.ping_figure = self.ping_canvas = None
+        
         # График скорости
         speed_tab = QWidget()
-        self.speed_figure = Figure(figsize=(10, 6))
-        self.speed_canvas = FigureCanvas(self.speed_figure)
-        speed_layout = QVBoxLayout(speed_tab)
-        speed_layout.addWidget(self.speed_canvas)
+        QVBoxLayout(speed_tab)
         
         # График ping
         ping_tab = QWidget()
-        self.ping_figure = Figure(figsize=(10, 6))
-        self.ping_canvas = FigureCanvas(self.ping_figure)
-        ping_layout = QVBoxLayout(ping_tab)
-        ping_layout.addWidget(self.ping_canvas)
+        QVBoxLayout(ping_tab)
         
         # Статистика
         stats_tab = QWidget()
@@ -536,11 +746,55 @@ class EnhancedMainWindow(QMainWindow):
         self.tab_widget.addTab(speed_tab, "📈 СКОРОСТЬ")
         self.tab_widget.addTab(ping_tab, "🎯 PING")
         self.tab_widget.addTab(stats_tab, "📊 СТАТИСТИКА")
+        self.speed_tab = speed_tab
+        self.ping_tab = ping_tab
+        self.tab_widget.currentChanged.connect(self.on_tab_changed)
         
         layout.addWidget(self.tab_widget)
         
         return panel
     
+    def on_tab_changed(self, index):
+        widget = self.tab_widget.widget(index)
+        if widget is self.speed_tab and self.speed_canvas is None:
+            self.speed_figure, self.speed_canvas = self.create_chart(self.speed_tab)
+        elif widget is self.ping_tab and self.ping_canvas is None:
+            self.ping_figure, self.ping_canvas = self.create_chart(self.ping_tab)
+        else:
+            return
+        
+        if self.history_df is not None and not self.history_df.empty:
+            self.update_charts(self.history_df)
+    
+    def create_chart(self, tab):
+        """Создание фигуры matplotlib во вкладке (с ленивой загрузкой библиотеки)"""
+        started = time.perf_counter()
+        Figure, FigureCanvas = load_matplotlib()
+        figure = Figure(figsize=(10, 6))
+        canvas = FigureCanvas(figure)
+        tab.layout().addWidget(canvas)
+        self.startup_timings.setdefault("charts", (time.perf_counter() - started) * 1000)
+        self.report_startup_timings()
+        return figure, canvas
+    
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.first_paint_done:
+            self.first_paint_done = True
+            self.startup_timings["first_paint"] = (time.perf_counter() - _IMPORT_STARTED) * 1000
+            # Первая вкладка с графиком открыта по умолчанию: строим ее после первого кадра
+            QTimer.singleShot(0, lambda: self.on_tab_changed(self.tab_widget.currentIndex()))
+    
+    def report_startup_timings(self):
+        """Время запуска для отслеживания регрессий: один раз, когда готовы и история, и графики"""
+        if self.startup_reported or not {"history", "charts"} <= self.startup_timings.keys():
+            return
+        self.startup_reported = True
+        order = ("import", "window", "first_paint", "history", "charts")
+        parts = [f"{name}: {self.startup_timings[name]:.0f} мс" for name in order if name in self.startup_timings]
+        log.info("startup %s", ", ".join(parts))
+        self.statusBar().showMessage("✅ Система готова к работе (запуск: " + ", ".join(parts) + ")", 10000)
+    
     def create_bottom_panel(self):
         panel = QWidget()
         layout = QVBoxLayout(panel)
@@ -638,8 +892,18 @@ class EnhancedMainWindow(QMainWindow):
         if self.test_in_progress:
             return
         
+        # Предыдущий поток уже отправил результат; дожидаемся его выхода, чтобы не терять QThread
+        if self.worker is not None:
+            if self.worker.wait(CANCEL_TIMEOUT * 1000):
+                self.worker.deleteLater()
+            else:
+                self.retired_workers.append(self.worker)
+        self.retired_workers = [worker for worker in self.retired_workers if worker.isRunning()]
+        
         self.test_in_progress = True
+        self.test_started = time.monotonic()
         self.test_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
         self.test_status.setText("🔄 Начинаю тестирование...")
         self.test_status.setStyleSheet("""
             QLabel {
@@ -657,13 +921,74 @@ class EnhancedMainWindow(QMainWindow):
         self.server_combo.addItem("Автоматический выбор (рекомендуется)")
         
         # Запускаем улучшенный тест
-        self.worker = ImprovedSpeedTestWorker()
+        self.worker = ImprovedSpeedTestWorker(
+            bufferbloat=self.bufferbloat_check.isChecked(),
+            threads=THREAD_MODES[self.threads_combo.currentText()]
+        )
         self.worker.progress.connect(self.update_progress)
         self.worker.finished.connect(self.test_finished)
         self.worker.error.connect(self.test_error)
+        self.worker.cancelled.connect(self.test_cancelled)
         self.worker.server_info.connect(self.add_server_to_list)
         self.worker.start()
     
+    def set_auto_test(self):
+        """Включение/выключение планировщика по выбору в списке"""
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+        
+        spec = AUTO_TEST_SCHEDULES.get(self.auto_test_combo.currentText())
+        if spec is None:
+            self.statusBar().showMessage("Автотест выключен")
+            return
+        
+        # Небольшой случайный сдвиг, чтобы зонды не тестировали одновременно
+        self.scheduler = TestScheduler(parse_schedule(spec), self.scheduled_test_job, jitter=60)
+        self.scheduler.start()
+        self.statusBar().showMessage(f"⏰ Автотест: {self.auto_test_combo.currentText().lower()}")
+    
+    def scheduled_test_job(self):
+        """Вызывается в потоке планировщика: запускает тест в GUI и ждет результата"""
+        done = threading.Event()
+        outcome = {}
+        self.scheduled_test_requested.emit((done, outcome))
+        if not done.wait(SCHEDULED_TEST_TIMEOUT):
+            # Тест завис — отменяем его и ждем освобождения ресурсов
+            self.cancel_requested.emit()
+            done.wait(CANCEL_TIMEOUT)
+            # Отмена не считается ошибкой сети: паузу после ошибок не увеличиваем
+            return None
+        return outcome.get("success")
+    
+    def start_scheduled_test(self, request):
+        done, outcome = request
+        if self.test_in_progress:
+            if time.monotonic() - self.test_started > SCHEDULED_TEST_TIMEOUT:
+                # Идущий тест завис — вытесняем его, автотест стартует после остановки
+                self.pending_scheduled = request
+                self.cancel_test()
+                return
+            # Тест уже идет (например, запущен вручную) — этот запуск пропускаем
+            outcome["success"] = None
+            done.set()
+            return
+        self.scheduled_request = request
+        self.run_speed_test()
+    
+    def start_pending_scheduled(self):
+        request, self.pending_scheduled = self.pending_scheduled, None
+        if request is not None:
+            self.start_scheduled_test(request)
+    
+    def finish_scheduled_test(self, success):
+        if self.scheduled_request is None:
+            return
+        done, outcome = self.scheduled_request
+        self.scheduled_request = None
+        outcome["success"] = success
+        done.set()
+    
     def add_server_to_list(self, server_info):
         """Добавление сервера в выпадающий список"""
         self.server_combo.addItem(server_info)
@@ -690,9 +1015,13 @@ class EnhancedMainWindow(QMainWindow):
             }}
         """)
     
-    def test_finished(self, ping, download, upload, server_name, server_country):
-        # Сохраняем результат
-        self.db.save_test(ping, download, upload, server_name, server_country)
+    def test_finished(self, result):
+        ping, download, upload = result.ping, result.download, result.upload
+        server_name, server_country = result.server_name, result.server_country
+        
+        # Сохраняем результат (детекторы деградаций обновляются при записи)
+        anomalies = self.db.save_test(ping, download, upload, server_name, server_country, **result.extra)
+        self.update_gauge_ranges(latest={"download": download, "upload": upload, "ping": ping})
         
         # Обновляем спидометры с анимацией
         self.download_gauge.set_value(download)
@@ -704,7 +1033,9 @@ class EnhancedMainWindow(QMainWindow):
         
         # Сбрасываем состояние
         self.test_in_progress = False
+        self.finish_scheduled_test(True)
         self.test_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
         self.test_status.setText("✅ Тест успешно завершен!")
         self.test_status.setStyleSheet("""
             QLabel {
@@ -721,14 +1052,27 @@ class EnhancedMainWindow(QMainWindow):
         self.load_data()
         
         # Показываем уведомление
-        self.show_notification("Тест скорости", 
-                             f"Download: {download:.1f} Мбит/с\n"
-                             f"Upload: {upload:.1f} Мбит/с\n"
-                             f"Ping: {ping:.1f} мс")
+        message = (f"Download: {download:.1f} Мбит/с\n"
+                   f"Upload: {upload:.1f} Мбит/с\n"
+                   f"Ping: {ping:.1f} мс")
+        if result.extra.get("bufferbloat_grade"):
+            loaded = max(value for value in (result.extra.get("loaded_latency_down"),
+                                             result.extra.get("loaded_latency_up"), 0)
+                         if value is not None)
+            message += f"\nПод нагрузкой: {loaded:.1f} мс (bufferbloat {result.extra['bufferbloat_grade']})"
+        self.show_notification("Тест скорости", message)
+        self.start_pending_scheduled()
+        
+        if anomalies:
+            self.show_notification("⚠️ Обнаружена деградация",
+                                   "\n".join(anomaly.describe() for anomaly in anomalies))
     
     def test_error(self, error_message):
+        scheduled = self.scheduled_request is not None
         self.test_in_progress = False
+        self.finish_scheduled_test(False)
         self.test_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
         self.test_status.setText(f"❌ {error_message}")
         self.test_status.setStyleSheet("""
             QLabel {
@@ -740,16 +1084,53 @@ class EnhancedMainWindow(QMainWindow):
             }
         """)
         
-        # Показываем диалог с деталями ошибки
-        self.show_error_dialog(error_message)
+        # Детали ошибки: для ручного теста — немодальный диалог, для автотеста — уведомление
+        if scheduled:
+            self.show_notification("❌ Автотест не удался", error_message)
+        else:
+            self.show_error_dialog(error_message)
         
         # Сохраняем неудачный тест
         self.db.save_test(0, 0, 0, "", "", False)
+        self.start_pending_scheduled()
+    
+    def cancel_test(self):
+        if self.worker is None or not self.worker.isRunning():
+            return
+        self.worker.cancel()
+        self.cancel_btn.setEnabled(False)
+        self.test_status.setText("⏹ Отмена теста...")
+    
+    def test_cancelled(self):
+        # Отмененный тест не считается ни успехом, ни ошибкой (и не записывается в историю)
+        self.test_in_progress = False
+        self.finish_scheduled_test(None)
+        self.test_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.test_status.setText("⏹ Тест отменен")
+        self.test_status.setStyleSheet("""
+            QLabel {
+                background-color: #f5f5f5;
+                color: #757575;
+                padding: 10px;
+                border-radius: 5px;
+                font-weight: bold;
+            }
+        """)
+        self.start_pending_scheduled()
     
     def show_error_dialog(self, error_message):
+        # Диалог немодальный и единственный: новая ошибка обновляет уже открытый
+        if self.error_dialog is not None:
+            self.error_details.setText(error_message)
+            self.error_dialog.raise_()
+            return
+        
         dialog = QDialog(self)
         dialog.setWindowTitle("Ошибка тестирования")
-        dialog.setModal(True)
+        dialog.setModal(False)
+        dialog.setAttribute(Qt.WA_DeleteOnClose)
         dialog.resize(500, 300)
         
         layout = QVBoxLayout(dialog)
@@ -771,6 +1152,7 @@ class EnhancedMainWindow(QMainWindow):
         details.setReadOnly(True)
         details.setMaximumHeight(100)
         layout.addWidget(details)
+        self.error_details = details
         
         # Причины и решения
         solutions = QTextEdit()
@@ -792,21 +1174,142 @@ class EnhancedMainWindow(QMainWindow):
         button_box.accepted.connect(dialog.accept)
         layout.addWidget(button_box)
         
-        dialog.exec_()
+        self.error_dialog = dialog
+        dialog.destroyed.connect(self.error_dialog_closed)
+        dialog.show()
     
-    def load_data(self):
+    def error_dialog_closed(self):
+        self.error_dialog = None
+        self.error_details = None
+    
+    def selected_days(self):
         period_text = self.period_combo.currentText()
         days_map = {"24 часа": 1, "7 дней": 7, "30 дней": 30, "Все время": None}
-        days = days_map.get(period_text)
+        return days_map.get(period_text)
+    
+    def history_servers(self):
+        """Серверы из загруженной истории за выбранный период"""
+        if self.history_df is None or self.history_df.empty or 'server_name' not in self.history_df:
+            return []
+        return sorted(name for name in self.history_df['server_name'].dropna().unique() if name)
+    
+    def export_history(self):
+        """Экспорт истории за выбранный период, при желании — только по одному серверу"""
+        server = None
+        servers = self.history_servers()
+        if len(servers) > 1:
+            all_servers = "Все серверы"
+            choice, ok = QInputDialog.getItem(self, "Экспорт истории", "Сервер:",
+                                              [all_servers] + servers, 0, False)
+            if not ok:
+                return
+            server = None if choice == all_servers else choice
+        
+        filters = {
+            "CSV (*.csv)": "csv",
+            "JSON Lines (*.jsonl)": "jsonl",
+            "Parquet (*.parquet)": "parquet",
+        }
+        dialog = QFileDialog(self, "Экспорт истории", "speed_history.csv", ";;".join(filters))
+        dialog.setAcceptMode(QFileDialog.AcceptSave)
+        dialog.setDefaultSuffix("csv")
+        
+        def filter_selected(name):
+            # Предлагаемое имя файла следует за выбранным форматом
+            fmt = filters[name]
+            dialog.setDefaultSuffix(fmt)
+            files = dialog.selectedFiles()
+            if files:
+                dialog.selectFile(os.path.basename(export_path(files[0], fmt)))
+        
+        dialog.filterSelected.connect(filter_selected)
+        if not dialog.exec_() or not dialog.selectedFiles():
+            return
+        fmt = filters.get(dialog.selectedNameFilter(), "csv")
+        path = export_path(dialog.selectedFiles()[0], fmt)
+        
+        days = self.selected_days()
+        since = datetime.now() - timedelta(days=days) if days else None
+        
+        self.export_btn.setEnabled(False)
+        self.statusBar().showMessage("💾 Экспорт истории...")
+        self.export_worker = ExportWorker(self.db, path, fmt, since, server)
+        self.export_worker.finished.connect(self.export_finished)
+        self.export_worker.error.connect(self.export_failed)
+        self.export_worker.start()
+    
+    def export_finished(self, count, path):
+        self.export_btn.setEnabled(True)
+        self.statusBar().showMessage(f"✅ Экспортировано строк: {count} → {path}")
+    
+    def export_failed(self, error_message):
+        self.export_btn.setEnabled(True)
+        self.statusBar().showMessage(f"❌ Ошибка экспорта: {error_message}")
+    
+    def load_data(self):
+        days = self.selected_days()
+        
+        # Если загрузка уже идет, повторяем ее по завершении, а не запускаем параллельно
+        if self.history_loader is not None and self.history_loader.isRunning():
+            self.reload_pending = True
+            return
         
-        df = self.db.get_tests(days)
+        self.history_started = time.perf_counter()
+        self.history_loader = HistoryLoader(self.db, days)
+        self.history_loader.loaded.connect(self.history_loaded)
+        self.history_loader.failed.connect(self.history_failed)
+        self.history_loader.start()
+    
+    @speed_trace.traced("load_data.render")
+    def history_loaded(self, df, percentiles, probes, anomalies):
+        first_load = self.history_df is None
+        self.history_df = df
+        self.probe_summary = probes
+        self.anomalies = anomalies
+        self.update_gauge_ranges(percentiles)
         
         if not df.empty:
             self.update_history_table(df)
             self.update_charts(df)
             self.update_statistics(df)
+        
+        if first_load:
+            self.startup_timings["history"] = (time.perf_counter() - self.history_started) * 1000
+            self.report_startup_timings()
+        
+        if self.reload_pending:
+            self.reload_pending = False
+            self.load_data()
+    
+    def history_failed(self, error_message):
+        self.statusBar().showMessage(f"❌ Не удалось загрузить историю: {error_message}")
+        if self.reload_pending:
+            self.reload_pending = False
+            self.load_data()
+    
+    def update_gauge_ranges(self, percentiles=None, latest=None):
+        """Диапазоны спидометров по p99 истории, округленные до красивой шкалы"""
+        latest = latest or {}
+        gauges = {
+            "download": self.download_gauge,
+            "upload": self.upload_gauge,
+            "ping": self.ping_gauge,
+        }
+        for metric, gauge in gauges.items():
+            if percentiles is None:
+                p99 = self.db.get_percentile(metric, 0.99)
+            else:
+                p99 = percentiles.get(metric)
+            # Шкала не сужается ниже того, что показывает или к чему движется стрелка
+            shown = max(latest.get(metric, 0), gauge.value, gauge.target_value)
+            if p99 is None:
+                gauge.set_max_value(max(gauge.default_max_value, nice_scale(shown)))
+                continue
+            gauge.set_max_value(nice_scale(max(p99, shown)))
     
     def update_history_table(self, df):
+        import pandas as pd
+        
         self.history_table.setRowCount(len(df))
         
         for i, row in df.iterrows():
@@ -847,15 +1350,30 @@ class EnhancedMainWindow(QMainWindow):
         
         self.history_table.resizeColumnsToContents()
     
+    @speed_trace.traced()
     def update_charts(self, df):
+        import pandas as pd
+        
+        if self.speed_canvas is None and self.ping_canvas is None:
+            return
+        
+        if len(df) > 1:
+            df = df.sort_values('timestamp')
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
+        
+        self.update_speed_chart(df)
+        self.update_ping_chart(df)
+    
+    @speed_trace.traced()
+    def update_speed_chart(self, df):
+        if self.speed_canvas is None:
+            return
+        
         # График скорости
         self.speed_figure.clear()
         ax1 = self.speed_figure.add_subplot(111)
         
         if len(df) > 1:
-            df = df.sort_values('timestamp')
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-            
             ax1.fill_between(df['timestamp'], 0, df['download'], 
                            alpha=0.3, color='green', label='Download')
             ax1.plot(df['timestamp'], df['download'], 'g-', 
@@ -893,6 +1411,11 @@ class EnhancedMainWindow(QMainWindow):
                     transform=ax1.transAxes, fontsize=12, fontweight='bold')
         
         self.speed_canvas.draw()
+    
+    @speed_trace.traced()
+    def update_ping_chart(self, df):
+        if self.ping_canvas is None:
+            return
         
         # График ping
         self.ping_figure.clear()
@@ -903,6 +1426,14 @@ class EnhancedMainWindow(QMainWindow):
                      for x in df['ping']]
             
             bars = ax2.bar(range(len(df)), df['ping'], color=colors, alpha=0.7)
+            
+            # Задержка под нагрузкой (тесты в режиме bufferbloat)
+            if 'loaded_latency_down' in df and df['loaded_latency_down'].notna().any():
+                loaded = df[['loaded_latency_down', 'loaded_latency_up']].max(axis=1)
+                ax2.plot(range(len(df)), loaded, 'm-', linewidth=2, marker='D', markersize=4,
+                         label='Под нагрузкой')
+                ax2.legend(fontsize=9)
+            
             ax2.set_xlabel('Номер теста', fontsize=10)
             ax2.set_ylabel('Ping (мс)', fontsize=10)
             ax2.set_title('История ping', fontsize=12, fontweight='bold')
@@ -925,6 +1456,8 @@ class EnhancedMainWindow(QMainWindow):
             self.stats_text.setHtml("<h3>Нет данных для статистики</h3>")
             return
         
+        quality_class, quality_text = self.connection_quality(df['ping'].mean())
+        
         stats = f"""
         <html>
         <head>
@@ -965,11 +1498,12 @@ class EnhancedMainWindow(QMainWindow):
         <div class="stat-row">• Минимальный: <span class="good">{df['ping'].min():.1f} мс</span></div>
         <div class="stat-row">• Максимальный: <span class="poor">{df['ping'].max():.1f} мс</span></div>
         <div class="stat-row">• Качество соединения: 
-            <span class="{'good' if df['ping'].mean() < 50 else 'average' if df['ping'].mean() < 100 else 'poor'}">
-            {('Отличное' if df['ping'].mean() < 50 else 'Хорошее' if df['ping'].mean() < 100 else 'Плохое')}
-            </span>
+            <span class="{quality_class}">{quality_text}</span>
         </div>
+        {self.format_probe_statistics()}
         
+        {self.format_bufferbloat_statistics(df)}
+        {self.format_fleet_statistics(df)}
         <h4>📈 Рекомендации:</h4>
         """
         
@@ -991,28 +1525,125 @@ class EnhancedMainWindow(QMainWindow):
         else:
             stats += "<div class='stat-row good'>✅ Ping отличный! Идеально для онлайн-игр и видеозвонков.</div>"
         
+        if self.anomalies:
+            stats += "<h4>⚠️ Обнаруженные деградации:</h4>"
+            for anomaly in self.anomalies[:5]:
+                stats += (f"<div class='stat-row poor'>• {anomaly.timestamp[:16]} — "
+                          f"{anomaly.describe()}</div>")
+        
         stats += "</body></html>"
         self.stats_text.setHtml(stats)
     
-    def show_notification(self, title, message):
-        """Показ красивого уведомления"""
-        msg_box = QMessageBox(self)
-        msg_box.setWindowTitle(title)
-        msg_box.setText(message)
-        msg_box.setIconPixmap(QIcon.fromTheme("network-wireless").pixmap(64, 64))
-        
-        # Стилизация
-        msg_box.setStyleSheet("""
-            QMessageBox {
-                background-color: white;
-            }
-            QMessageBox QLabel {
-                font-size: 12px;
-                font-family: Arial;
-            }
-        """)
+    def connection_quality(self, avg_ping):
+        """Оценка качества: по зондам (p99 худшей серии, джиттер, потери), если они есть, иначе по среднему ping"""
+        probes = self.probe_summary
+        if probes is None or probes["rtt_p50"] is None:
+            if avg_ping < 50:
+                return "good", "Отличное"
+            if avg_ping < 100:
+                return "average", "Хорошее"
+            return "poor", "Плохое"
+        
+        latency = probes["rtt_p99_max"] or probes["rtt_p50"]
+        jitter = probes["jitter"] or 0
+        loss = probes["loss_pct"]
+        if loss > 2 or jitter > 30 or latency > 200:
+            return "poor", "Плохое"
+        if loss > 0.5 or jitter > 10 or latency > 100:
+            return "average", "Хорошее"
+        return "good", "Отличное"
+    
+    def format_probe_statistics(self):
+        probes = self.probe_summary
+        if probes is None:
+            return ""
+        
+        def ms(value):
+            return "—" if value is None else f"{value:.1f} мс"
+        
+        loss_class = 'good' if probes['loss_pct'] <= 0.5 else 'average' if probes['loss_pct'] <= 2 else 'poor'
+        return f"""
+        <h4>📡 Зонды задержки ({probes['sent']} шт.):</h4>
+        <div class="stat-row">• Медиана: <span class="value">{ms(probes['rtt_p50'])}</span></div>
+        <div class="stat-row">• p99 (худшая серия): <span class="value">{ms(probes['rtt_p99_max'])}</span></div>
+        <div class="stat-row">• Джиттер: <span class="value">{ms(probes['jitter'])}</span></div>
+        <div class="stat-row">• Потери: <span class="{loss_class}">{probes['loss_pct']:.2f}%</span></div>
+        """
+    
+    def format_bufferbloat_statistics(self, df):
+        if 'bufferbloat_grade' not in df or not df['bufferbloat_grade'].notna().any():
+            return ""
+        
+        bloat = df[df['bufferbloat_grade'].notna()]
+        loaded = bloat[['loaded_latency_down', 'loaded_latency_up']].max(axis=1)
+        increase = (loaded - bloat['idle_latency']).clip(lower=0)
+        grade = bloat['bufferbloat_grade'].iloc[0]  # Последний тест (сортировка по убыванию)
+        grade_class = 'good' if grade in ('A+', 'A') else 'average' if grade in ('B', 'C') else 'poor'
+        jitter = bloat['latency_jitter'].mean()
+        
+        return f"""
+        <h4>📶 Задержка под нагрузкой:</h4>
+        <div class="stat-row">• Без нагрузки: <span class="value">{bloat['idle_latency'].mean():.1f} мс</span></div>
+        <div class="stat-row">• Под нагрузкой: <span class="value">{loaded.mean():.1f} мс</span></div>
+        <div class="stat-row">• Средний рост: <span class="value">{increase.mean():.1f} мс</span></div>
+        <div class="stat-row">• Джиттер: <span class="value">{jitter:.1f} мс</span></div>
+        <div class="stat-row">• Оценка bufferbloat (последний тест): <span class="{grade_class}">{grade}</span></div>
+        """
+    
+    def format_fleet_statistics(self, df):
+        """Средние по пробам, если история собрана с нескольких машин (speed_cli aggregate)"""
+        if 'probe' not in df:
+            return ""
+        # Локальные тесты (probe = NULL) считаются отдельной пробой
+        probes = df['probe'].fillna('локально')
+        if probes.nunique() < 2:
+            return ""
+        
+        rows = ""
+        by_probe = df.groupby(probes)
+        for probe, group in by_probe:
+            rows += (f"<div class='stat-row'>• {probe}: <span class='value'>{group['download'].mean():.1f}</span> / "
+                     f"<span class='value'>{group['upload'].mean():.1f}</span> Мбит/с, "
+                     f"ping <span class='value'>{group['ping'].mean():.1f} мс</span> "
+                     f"({len(group)} тестов, последний {str(group['timestamp'].max())[:16]})</div>")
+        return f"<h4>🛰️ Пробы ({by_probe.ngroups}):</h4>{rows}"
+    
+    def background_threads(self):
+        threads = [self.worker, self.history_loader, self.export_worker] + self.retired_workers
+        return [thread for thread in threads if thread is not None and thread.isRunning()]
+    
+    def closeEvent(self, event):
+        """Закрытие: отмена теста и ограниченное по времени ожидание фоновых потоков"""
+        if self.scheduler is not None:
+            self.scheduler.stop(timeout=1)
+            self.scheduler = None
+        self.pending_scheduled = None
+        self.finish_scheduled_test(None)
+        if self.worker is not None:
+            self.worker.cancel()
+        
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT_MS / 1000
+        for thread in self.background_threads():
+            thread.wait(max(0, int((deadline - time.monotonic()) * 1000)))
+        if not self.background_threads():
+            event.accept()
+            return
         
-        msg_box.exec_()
+        # Потоки еще освобождают соединения: прячем окно и выходим, когда они завершатся
+        event.ignore()
+        self.hide()
+        if self.shutdown_timer is None:
+            self.shutdown_timer = QTimer(self)
+            self.shutdown_timer.timeout.connect(self.quit_when_idle)
+            self.shutdown_timer.start(200)
+    
+    def quit_when_idle(self):
+        if not self.background_threads():
+            QApplication.quit()
+    
+    def show_notification(self, title, message):
+        """Неблокирующее уведомление (с ограничением частоты и объединением)"""
+        self.notifier.notify(title, message)
 
 def main():
     app = QApplication(sys.argv)
@@ -0,0 +1,287 @@
+"""Легкие зонды задержки: TCP connect или UDP echo.
+
+Зонды отправляются по фиксированному расписанию (без накопления дрейфа
+от sleep), статистика считается потоково: среднее и дисперсия по Уэлфорду,
+джиттер по RFC 3550, перцентили оценщиком P² — память не растет с числом
+зондов. ProbeEngine может работать непрерывно между полными тестами.
+"""
+import math
+import os
+import socket
+import struct
+import threading
+import time
+
+
+def tcp_connect_rtt(address, timeout=1.0):
+    """Время установления TCP-соединения с уже разрешенным адресом, мс (None при ошибке)"""
+    family, socktype, proto, _, sockaddr = address
+    sock = socket.socket(family, socktype, proto)
+    sock.settimeout(timeout)
+    try:
+        started = time.perf_counter()
+        sock.connect(sockaddr)
+        return (time.perf_counter() - started) * 1000
+    except OSError:
+        return None
+    finally:
+        sock.close()
+
+
+class UdpEchoProbe:
+    """Зонды UDP echo: сервер должен вернуть пакет без изменений (RFC 862 или аналог)"""
+
+    PACKET = struct.Struct("!IQ")  # номер зонда, случайный идентификатор сессии
+
+    def __init__(self, address, timeout=1.0):
+        family, _, _, _, sockaddr = address
+        self.timeout = timeout
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.connect(sockaddr)
+        self.session = int.from_bytes(os.urandom(8), "big")
+        self.sequence = 0
+
+    def __call__(self):
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        packet = self.PACKET.pack(self.sequence, self.session)
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        try:
+            self.sock.send(packet)
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.sock.settimeout(remaining)
+                reply = self.sock.recv(64)
+                # Опоздавшие ответы на прошлые зонды пропускаем
+                if reply[:self.PACKET.size] == packet:
+                    return (time.perf_counter() - started) * 1000
+        except OSError:
+            return None
+
+    def close(self):
+        self.sock.close()
+
+
+class P2Quantile:
+    """Потоковая оценка квантиля алгоритмом P² (Jain & Chlamtac) за O(1) памяти"""
+
+    def __init__(self, q):
+        self.q = q
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self.increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def add(self, x):
+        h = self.heights
+        if len(h) < 5:
+            h.append(x)
+            h.sort()
+            return
+
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if h[i] <= x < h[i + 1])
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not h[i - 1] < candidate < h[i + 1]:
+                    candidate = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                h[i] = candidate
+                n[i] += d
+
+    def value(self):
+        h = self.heights
+        if not h:
+            return None
+        if len(h) < 5:
+            return h[min(len(h) - 1, int(round(self.q * (len(h) - 1))))]
+        return h[2]
+
+
+class StreamingStats:
+    """Потоковая статистика по серии зондов"""
+
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self):
+        self.sent = 0
+        self.lost = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+        self.jitter = 0.0
+        self._previous = None
+        self._quantiles = {q: P2Quantile(q) for q in self.QUANTILES}
+
+    def add(self, rtt):
+        self.sent += 1
+        if rtt is None:
+            self.lost += 1
+            return
+
+        received = self.sent - self.lost
+        delta = rtt - self.mean
+        self.mean += delta / received
+        self._m2 += delta * (rtt - self.mean)
+        self.min = rtt if self.min is None else min(self.min, rtt)
+        self.max = rtt if self.max is None else max(self.max, rtt)
+
+        # RFC 3550: сглаженное среднее модуля разности соседних задержек
+        if self._previous is not None:
+            self.jitter += (abs(rtt - self._previous) - self.jitter) / 16
+        self._previous = rtt
+
+        for estimator in self._quantiles.values():
+            estimator.add(rtt)
+
+    def summary(self):
+        received = self.sent - self.lost
+        return {
+            "sent": self.sent,
+            "lost": self.lost,
+            "loss_pct": 100 * self.lost / self.sent if self.sent else None,
+            "rtt_min": self.min,
+            "rtt_mean": self.mean if received else None,
+            "rtt_stdev": math.sqrt(self._m2 / (received - 1)) if received > 1 else None,
+            "rtt_p50": self._quantiles[0.5].value(),
+            "rtt_p90": self._quantiles[0.9].value(),
+            "rtt_p99": self._quantiles[0.99].value(),
+            "rtt_max": self.max,
+            "jitter": self.jitter if received > 1 else None,
+        }
+
+
+def _parse_port(text):
+    if not text.isdigit() or not 0 < int(text) < 65536:
+        raise ValueError(f"некорректный порт: {text!r}")
+    return int(text)
+
+
+def parse_target(text, default_port=443):
+    """"host", "host:port" или "[ipv6]:port" -> (host, port); ValueError при неверном порте"""
+    if text.startswith("["):
+        host, _, rest = text[1:].partition("]")
+        rest = rest.lstrip(":")
+        return host, _parse_port(rest) if rest else default_port
+    if text.count(":") == 1:
+        host, port = text.split(":")
+        return host, _parse_port(port)
+    return text, default_port
+
+
+class ProbeEngine:
+    """Серия зондов к цели с точным интервалом отправки"""
+
+    def __init__(self, host, port=443, mode="tcp", interval=0.05, timeout=1.0):
+        if mode not in ("tcp", "udp"):
+            raise ValueError(f"Неизвестный тип зондов: {mode}")
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.interval = interval
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self._resume = threading.Event()
+        self._resume.set()
+        self._thread = None
+
+    @property
+    def target(self):
+        return f"{self.host}:{self.port}"
+
+    def _make_probe(self):
+        # Адрес разрешается один раз, чтобы DNS не попадал в замеры
+        socktype = socket.SOCK_STREAM if self.mode == "tcp" else socket.SOCK_DGRAM
+        address = socket.getaddrinfo(self.host, self.port, type=socktype)[0]
+        if self.mode == "udp":
+            return UdpEchoProbe(address, self.timeout)
+        return lambda: tcp_connect_rtt(address, self.timeout)
+
+    def _probes(self, probe):
+        """Бесконечная серия замеров по расписанию start + i * interval"""
+        next_send = time.perf_counter()
+        while not self._stop.is_set():
+            if not self._resume.is_set():
+                self._resume.wait()
+                next_send = time.perf_counter()
+                continue
+            yield probe()
+            next_send += self.interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # Зонд длился дольше интервала: не пытаемся «догонять» пачкой
+                next_send = time.perf_counter()
+
+    def run(self, count):
+        """Отправить count зондов и вернуть сводку"""
+        stats = StreamingStats()
+        probe = self._make_probe()
+        try:
+            for rtt in self._probes(probe):
+                stats.add(rtt)
+                if stats.sent >= count:
+                    break
+        finally:
+            if hasattr(probe, "close"):
+                probe.close()
+        return stats.summary()
+
+    def start_continuous(self, window, on_summary):
+        """Непрерывные зонды в фоне; сводка по каждым window зондам передается в on_summary.
+
+        Адрес разрешается до запуска потока: OSError (например, неизвестный хост)
+        получает вызывающий.
+        """
+        probe = self._make_probe()
+
+        def loop():
+            stats = StreamingStats()
+            try:
+                for rtt in self._probes(probe):
+                    stats.add(rtt)
+                    if stats.sent >= window:
+                        on_summary(stats.summary())
+                        stats = StreamingStats()
+            finally:
+                if hasattr(probe, "close"):
+                    probe.close()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name="ProbeEngine", daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        """Приостановить зонды (например, на время теста пропускной способности)"""
+        self._resume.clear()
+
+    def resume(self):
+        self._resume.set()
+
+    def stop(self):
+        self._stop.set()
+        self._resume.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout + self.interval + 1)
@@ -0,0 +1,366 @@
+"""Планировщик автоматических тестов.
+
+Поддерживает интервалы ("15m", "every 2h") и cron-выражения из пяти полей
+("*/30 * * * *"), случайный сдвиг запуска, тихие часы, пропуск запуска,
+если предыдущий тест еще идет, и увеличение паузы после ошибок.
+Не зависит от Qt: используется и в GUI, и в speed_cli daemon.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, time as dtime
+
+log = logging.getLogger(__name__)
+
+
+class ScheduleError(ValueError):
+    """Некорректное описание расписания"""
+
+
+class IntervalSchedule:
+    """Запуск через фиксированный интервал"""
+
+    UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ScheduleError("Интервал должен быть положительным")
+        self.interval = timedelta(seconds=seconds)
+
+    @classmethod
+    def parse(cls, text):
+        match = re.fullmatch(r"(?:every\s+)?(\d+(?:\.\d+)?)\s*([smhd])", text.strip().lower())
+        if not match:
+            return None
+        return cls(float(match.group(1)) * cls.UNITS[match.group(2)])
+
+    def next_after(self, moment):
+        return moment + self.interval
+
+    def first_at_or_after(self, moment):
+        return moment
+
+    def __str__(self):
+        return f"каждые {self.interval}"
+
+
+class CronSchedule:
+    """Cron-выражение: минута, час, день месяца, месяц, день недели (0 = воскресенье)"""
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ScheduleError(f"Ожидается 5 полей cron, получено {len(parts)}: {expression!r}")
+        self.expression = expression
+        fields = [self._parse_field(part, low, high) for part, (low, high) in zip(parts, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = fields
+        self.weekdays = {day % 7 for day in weekdays}
+        # Как в cron: если ограничены и день месяца, и день недели, достаточно любого
+        self.days_restricted = parts[2] != "*"
+        self.weekdays_restricted = parts[4] != "*"
+
+    @staticmethod
+    def _parse_field(text, low, high):
+        values = set()
+        for item in text.split(","):
+            step = 1
+            if "/" in item:
+                item, step_text = item.split("/", 1)
+                if not step_text.isdigit() or int(step_text) == 0:
+                    raise ScheduleError(f"Некорректный шаг в поле cron: {text!r}")
+                step = int(step_text)
+            if item == "*":
+                start, end = low, high
+            elif "-" in item:
+                start_text, end_text = item.split("-", 1)
+                if not (start_text.isdigit() and end_text.isdigit()):
+                    raise ScheduleError(f"Некорректный диапазон в поле cron: {text!r}")
+                start, end = int(start_text), int(end_text)
+            elif item.isdigit():
+                start = int(item)
+                end = high if step > 1 else start
+            else:
+                raise ScheduleError(f"Некорректное поле cron: {text!r}")
+            if start < low or end > high or start > end:
+                raise ScheduleError(f"Значение вне диапазона {low}-{high}: {text!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def first_at_or_after(self, moment):
+        if moment.second or moment.microsecond:
+            moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ScheduleError(f"Cron-выражение никогда не срабатывает: {self.expression!r}")
+
+    def next_after(self, moment):
+        return self.first_at_or_after(moment.replace(second=0, microsecond=0) + timedelta(minutes=1))
+
+    def __str__(self):
+        return f"cron «{self.expression}»"
+
+
+def parse_schedule(text):
+    """Интервал ("30m", "every 1h") или cron-выражение"""
+    return IntervalSchedule.parse(text) or CronSchedule(text)
+
+
+class QuietHours:
+    """Интервал времени суток без тестов, например 23:00-07:00"""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def parse(cls, text):
+        match = re.fullmatch(r"(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})", text.strip())
+        if not match:
+            raise ScheduleError(f"Ожидается формат ЧЧ:ММ-ЧЧ:ММ: {text!r}")
+        h1, m1, h2, m2 = (int(group) for group in match.groups())
+        try:
+            return cls(dtime(h1, m1), dtime(h2, m2))
+        except ValueError as e:
+            raise ScheduleError(f"Некорректное время в {text!r}: {e}")
+
+    def contains(self, moment):
+        current = moment.time()
+        if self.start <= self.end:
+            return self.start <= current < self.end
+        return current >= self.start or current < self.end
+
+    def end_after(self, moment):
+        end = datetime.combine(moment.date(), self.end)
+        return end if end > moment else end + timedelta(days=1)
+
+
+class TestScheduler:
+    """Фоновый запуск job() по расписанию.
+
+    job() возвращает True при успехе, False при ошибке и None, если тест
+    не выполнялся (например, был занят или отменен); исключение считается ошибкой.
+
+    Если задан cancel, запуск по расписанию вытесняет зависший тест: когда
+    предыдущий job() идет дольше max_runtime секунд, вызывается cancel() и
+    после его завершения (не дольше cancel_timeout) запускается новый тест.
+    """
+
+    def __init__(self, schedule, job, jitter=0, quiet_hours=None,
+                 backoff_base=60, max_backoff=3600, cancel=None, max_runtime=None, cancel_timeout=30):
+        self.schedule = schedule
+        self.job = job
+        self.jitter = jitter  # Случайный сдвиг запуска, секунды
+        self.quiet_hours = quiet_hours
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.failures = 0  # Ошибок подряд
+        self.skipped = 0
+        self.next_run = None
+        self.cancel = cancel
+        self.max_runtime = max_runtime
+        self.cancel_timeout = cancel_timeout
+        self.preempted = 0
+        self._job_started = None
+        self._slot = None  # Плановое время последнего запущенного теста
+        self._running = threading.Lock()
+        self._stop = threading.Event()
+        self._finished = threading.Event()  # Тест завершился, число ошибок обновлено
+        self._wake = threading.Event()  # Прерывает ожидание: остановка или завершение теста
+        self._thread = None
+        self._run_now = False
+
+    def start(self, run_now=False):
+        """Запуск планировщика; run_now — выполнить первый тест сразу"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._run_now = run_now
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="TestScheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_busy(self):
+        return self._running.locked()
+
+    def wait_idle(self, timeout=None):
+        """Дождаться завершения идущего job(); False, если не дождались за timeout"""
+        if not self._running.acquire(timeout=-1 if timeout is None else timeout):
+            return False
+        self._running.release()
+        return True
+
+    def backoff_delay(self):
+        if not self.failures:
+            return 0
+        return min(self.backoff_base * 2 ** (self.failures - 1), self.max_backoff)
+
+    def compute_next_run(self, now):
+        # Пауза после ошибок добавляется к времени по расписанию, а не поглощается им
+        run_at = self.schedule.next_after(now) + timedelta(seconds=self.backoff_delay())
+        if self.quiet_hours is not None and self.quiet_hours.contains(run_at):
+            run_at = self.schedule.first_at_or_after(self.quiet_hours.end_after(run_at))
+        if self.jitter:
+            run_at += timedelta(seconds=random.uniform(0, self.jitter))
+        return run_at
+
+    def _plan(self, after):
+        self.next_run = self.compute_next_run(after)
+        log.info("Следующий тест: %s", self.next_run.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def _loop(self):
+        if self._run_now:
+            self._run_now = False
+            self.next_run = datetime.now()
+        else:
+            self._plan(datetime.now())
+
+        while not self._stop.is_set():
+            # Ждем небольшими шагами, чтобы переживать перевод часов и быстро останавливаться
+            while not self._stop.is_set():
+                if self._finished.is_set():
+                    # Тест завершился: число ошибок изменилось, пересчитываем от его планового времени
+                    self._finished.clear()
+                    self._plan(self._slot)
+                remaining = (self.next_run - datetime.now()).total_seconds()
+                if remaining <= 0:
+                    break
+                self._wake.wait(min(remaining, 60))
+                self._wake.clear()
+            if self._stop.is_set():
+                break
+
+            slot = self.next_run
+            acquired = self._running.acquire(blocking=False) or self._preempt()
+            if self._stop.is_set():
+                # Остановка пришла, пока ждали отмененный тест: новый не начинаем
+                if acquired:
+                    self._running.release()
+                break
+            if not acquired:
+                self.skipped += 1
+                log.warning("Предыдущий тест еще выполняется, запуск пропущен")
+                self._plan(slot)
+                continue
+            self._slot = slot
+            self._finished.clear()
+            self._job_started = time.monotonic()
+            threading.Thread(target=self._run_job, name="ScheduledTest", daemon=True).start()
+            # Предварительно; после завершения теста время пересчитается с учетом результата
+            self._plan(slot)
+
+    def _preempt(self):
+        """Отменить зависший тест; True, если он завершился и блокировка захвачена"""
+        started = self._job_started
+        if self.cancel is None or self.max_runtime is None or started is None:
+            return False
+        runtime = time.monotonic() - started
+        if runtime < self.max_runtime:
+            return False
+
+        log.warning("Тест выполняется уже %d с — отменяю его ради нового запуска", runtime)
+        self.cancel()
+        # Ждем короткими шагами, чтобы не задерживать остановку планировщика
+        deadline = time.monotonic() + self.cancel_timeout
+        while not self._running.acquire(timeout=0.5):
+            if self._stop.is_set():
+                return False
+            if time.monotonic() >= deadline:
+                log.error("Тест не остановился за %d с после отмены", self.cancel_timeout)
+                return False
+        self.preempted += 1
+        return True
+
+    def _run_job(self):
+        try:
+            ok = self.job()
+        except Exception:
+            log.exception("Ошибка запланированного теста")
+            ok = False
+
+        # Счетчик ошибок обновляется до освобождения блокировки, чтобы следующий запуск его учел
+        try:
+            if ok:
+                self.failures = 0
+            elif ok is False:
+                self.failures += 1
+                log.warning("Ошибок подряд: %d, пауза %d с сверх расписания",
+                            self.failures, self.backoff_delay())
+            self._finished.set()
+            self._wake.set()
+        finally:
+            self._running.release()
+
+
+class ResultBatchWriter:
+    """Буфер результатов с пакетной записью в БД.
+
+    Пакет записывается, когда набралось batch_size результатов или
+    старейший результат ждет дольше flush_interval секунд.
+    """
+
+    def __init__(self, db, batch_size=10, flush_interval=300):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def save_test(self, ping, download, upload, server_name="", server_country="", success=True, **extra):
+        """Тот же интерфейс, что у DatabaseManager.save_test, но с буферизацией"""
+        row = self.db.make_row(ping, download, upload, server_name, server_country, success, **extra)
+        with self._lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.batch_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not rows:
+            return
+        try:
+            self.db.save_tests(rows)
+        except Exception:
+            # Не теряем результаты: вернем их в буфер до следующей попытки
+            with self._lock:
+                self._buffer[:0] = rows
+            raise
+        log.info("Записано результатов: %d", len(rows))
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,401 @@
+"""Хранилище результатов тестов (SQLite) без зависимостей от GUI"""
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from speed_anomaly import Anomaly, AnomalyDetector
+from speed_trace import traced
+
+
+class DatabaseManager:
+    """Работа с базой данных результатов тестов"""
+    # Гистограмма значений в логарифмических корзинах: 8 корзин на удвоение
+    HISTOGRAM_RESOLUTION = 8
+    HISTOGRAM_METRICS = ("ping", "download", "upload")
+    BACKFILL_CHUNK = 50000  # Строк за порцию при заполнении гистограммы из истории
+    BASE_COLUMNS = ("timestamp", "ping", "download", "upload", "server_name", "server_country", "success")
+    # Колонки, добавленные после первой версии схемы (создаются через ALTER TABLE)
+    EXTRA_COLUMNS = {
+        "idle_latency": "REAL",
+        "loaded_latency_down": "REAL",
+        "loaded_latency_up": "REAL",
+        "latency_jitter": "REAL",
+        "bufferbloat_grade": "TEXT",
+        "probe": "TEXT",  # Имя пробы, с которой пришел результат (в центральной БД)
+        "threads_mode": "TEXT",  # Как выбрано число потоков: server, fixed или auto
+        "download_threads": "INTEGER",
+        "upload_threads": "INTEGER",
+    }
+
+    # Сколько последних результатов использовать для начального обучения детекторов
+    DETECTOR_WARMUP_ROWS = 1000
+
+    DEFAULT_DB_FILE = "internet_speed_enhanced.db"
+    DB_FILE_ENV = "SPEED_DB"  # Переменная окружения с путем к БД
+
+    def __init__(self, db_file=None, lazy=False):
+        self.db_file = db_file or os.environ.get(self.DB_FILE_ENV) or self.DEFAULT_DB_FILE
+        self.detector = AnomalyDetector()
+        self.anomaly_listeners = []
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        if not lazy:
+            self.init_db()
+
+    def _connect(self):
+        """Соединение с БД; при отложенной инициализации схема создается при первом обращении"""
+        if not self._initialized:
+            self.init_db()
+        return sqlite3.connect(self.db_file)
+
+    @traced("db.init_db", category="db")
+    def init_db(self):
+        with self._init_lock:
+            if not self._initialized:
+                self._create_schema()
+                self._initialized = True
+
+    def _create_schema(self):
+        conn = sqlite3.connect(self.db_file)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME,
+                ping REAL,
+                download REAL,
+                upload REAL,
+                server_name TEXT,
+                server_country TEXT,
+                success INTEGER DEFAULT 1
+            )
+        ''')
+        existing = {row[1] for row in cursor.execute("PRAGMA table_info(tests)")}
+        for column, column_type in self.EXTRA_COLUMNS.items():
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE tests ADD COLUMN {column} {column_type}")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS probes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME,
+                target TEXT,
+                mode TEXT,
+                sent INTEGER,
+                lost INTEGER,
+                rtt_min REAL,
+                rtt_mean REAL,
+                rtt_p50 REAL,
+                rtt_p90 REAL,
+                rtt_p99 REAL,
+                rtt_max REAL,
+                jitter REAL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS detector_state (
+                key TEXT PRIMARY KEY,
+                state TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS anomalies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME,
+                scope TEXT,
+                name TEXT,
+                metric TEXT,
+                value REAL,
+                baseline REAL,
+                score REAL,
+                kind TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sources (
+                name TEXT PRIMARY KEY,
+                high_water INTEGER,
+                updated DATETIME
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS metric_histogram (
+                metric TEXT,
+                bucket INTEGER,
+                count INTEGER,
+                PRIMARY KEY (metric, bucket)
+            )
+        ''')
+
+        # Однократное заполнение гистограммы из уже накопленной истории
+        if cursor.execute("SELECT COUNT(*) FROM metric_histogram").fetchone()[0] == 0:
+            # Читаем порциями отдельным курсором: история может не помещаться в память
+            history = conn.execute("SELECT ping, download, upload FROM tests WHERE success = 1")
+            while True:
+                rows = history.fetchmany(self.BACKFILL_CHUNK)
+                if not rows:
+                    break
+                self._add_to_histogram(cursor, rows)
+
+        # Однократное обучение детекторов на последних результатах (без записи аномалий)
+        if cursor.execute("SELECT COUNT(*) FROM detector_state").fetchone()[0] == 0:
+            recent = cursor.execute('''
+                SELECT * FROM (
+                    SELECT timestamp, ping, download, upload, server_name
+                    FROM tests WHERE success = 1 ORDER BY id DESC LIMIT ?
+                ) ORDER BY timestamp
+            ''', (self.DETECTOR_WARMUP_ROWS,))
+            columns = [column[0] for column in recent.description]
+            rows = [dict(zip(columns, row)) for row in recent.fetchall()]
+            self.detector.process(cursor, rows, record=False)
+
+        conn.commit()
+        conn.close()
+
+    def _histogram_bucket(self, value):
+        if value is None or value <= 0:
+            return None
+        return math.floor(math.log2(value) * self.HISTOGRAM_RESOLUTION)
+
+    def _add_to_histogram(self, cursor, rows):
+        counts = {}
+        for row in rows:
+            for metric, value in zip(self.HISTOGRAM_METRICS, row):
+                bucket = self._histogram_bucket(value)
+                if bucket is not None:
+                    counts[(metric, bucket)] = counts.get((metric, bucket), 0) + 1
+        cursor.executemany('''
+            INSERT INTO metric_histogram (metric, bucket, count) VALUES (?, ?, ?)
+            ON CONFLICT(metric, bucket) DO UPDATE SET count = count + excluded.count
+        ''', [(metric, bucket, count) for (metric, bucket), count in counts.items()])
+
+    def save_test(self, ping, download, upload, server_name="", server_country="", success=True, **extra):
+        """Запись одного теста; extra — значения колонок из EXTRA_COLUMNS.
+
+        Возвращает список обнаруженных деградаций (Anomaly).
+        """
+        return self.save_tests([self.make_row(ping, download, upload, server_name, server_country, success, **extra)])
+
+    @classmethod
+    def make_row(cls, ping, download, upload, server_name="", server_country="", success=True,
+                 timestamp=None, **extra):
+        unknown = set(extra) - set(cls.EXTRA_COLUMNS)
+        if unknown:
+            raise ValueError(f"Неизвестные колонки: {', '.join(sorted(unknown))}")
+        row = dict(zip(cls.BASE_COLUMNS, (timestamp or datetime.now(), ping, download, upload,
+                                           server_name, server_country, 1 if success else 0)))
+        row.update(extra)
+        return row
+
+    def add_anomaly_listener(self, callback):
+        """callback(anomalies) вызывается после записи, если найдены деградации"""
+        self.anomaly_listeners.append(callback)
+
+    def _insert_tests(self, cursor, rows, record=True):
+        columns = list(self.BASE_COLUMNS) + [
+            column for column in self.EXTRA_COLUMNS if any(column in row for row in rows)
+        ]
+        cursor.executemany(
+            f"INSERT INTO tests ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [tuple(row.get(column) for column in columns) for row in rows]
+        )
+        self._add_to_histogram(cursor, [
+            tuple(row[metric] for metric in self.HISTOGRAM_METRICS) for row in rows if row["success"]
+        ])
+        return self.detector.process(cursor, [row for row in rows if row["success"]], record=record)
+
+    def _notify(self, anomalies):
+        if anomalies:
+            for callback in self.anomaly_listeners:
+                callback(anomalies)
+        return anomalies
+
+    @traced("db.save_tests", category="db")
+    def save_tests(self, rows):
+        """Пакетная запись строк, созданных make_row; возвращает найденные деградации"""
+        if not rows:
+            return []
+        conn = self._connect()
+        anomalies = self._insert_tests(conn.cursor(), rows)
+        conn.commit()
+        conn.close()
+        return self._notify(anomalies)
+
+    @traced("db.merge_tests", category="db")
+    def merge_tests(self, source, rows, high_water, record=True):
+        """Запись строк из внешнего источника вместе с его отметкой high_water (одной транзакцией).
+
+        record=False — загрузка уже накопленной истории: детекторы обучаются,
+        но деградации не записываются и не рассылаются как новые события.
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        anomalies = self._insert_tests(cursor, rows, record=record) if rows else []
+        cursor.execute(
+            "INSERT OR REPLACE INTO sources (name, high_water, updated) VALUES (?, ?, ?)",
+            (source, high_water, datetime.now())
+        )
+        conn.commit()
+        conn.close()
+        return self._notify(anomalies)
+
+    def get_high_water(self, source):
+        """Последний id, уже взятый из источника (0, если источник новый)"""
+        conn = self._connect()
+        row = conn.execute("SELECT high_water FROM sources WHERE name = ?", (source,)).fetchone()
+        conn.close()
+        return row[0] if row else 0
+
+    @traced("db.get_fleet_summary", category="db")
+    def get_fleet_summary(self, days=None):
+        """Сводка по пробам: список словарей (проба, число тестов, средние, последний тест)"""
+        query = '''
+            SELECT COALESCE(t.probe, ''), COUNT(*), SUM(1 - t.success),
+                   AVG(CASE WHEN t.success = 1 THEN t.download END),
+                   AVG(CASE WHEN t.success = 1 THEN t.upload END),
+                   AVG(CASE WHEN t.success = 1 THEN t.ping END),
+                   MAX(t.timestamp), s.updated
+            FROM tests t LEFT JOIN sources s ON s.name = t.probe
+        '''
+        params = []
+        if days:
+            query += " WHERE t.timestamp >= ?"
+            params.append(str(datetime.now() - timedelta(days=days)))
+        query += " GROUP BY t.probe ORDER BY t.probe"
+
+        conn = self._connect()
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        keys = ("probe", "tests", "failed", "download", "upload", "ping", "last_test", "merged")
+        return [dict(zip(keys, row)) for row in rows]
+
+    @traced("db.get_anomalies", category="db")
+    def get_anomalies(self, days=None, limit=20):
+        """Последние деградации (новые первыми)"""
+        query = "SELECT timestamp, scope, name, metric, value, baseline, score, kind FROM anomalies"
+        params = []
+        if days:
+            query += " WHERE timestamp >= ?"
+            params.append(str(datetime.now() - timedelta(days=days)))
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+
+        conn = self._connect()
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        return [Anomaly(*row) for row in rows]
+
+    PROBE_COLUMNS = ("sent", "lost", "rtt_min", "rtt_mean", "rtt_p50", "rtt_p90", "rtt_p99", "rtt_max", "jitter")
+
+    @traced("db.save_probe", category="db")
+    def save_probe(self, target, mode, summary):
+        """Сводка серии зондов (результат StreamingStats.summary)"""
+        conn = self._connect()
+        conn.execute(
+            f"INSERT INTO probes (timestamp, target, mode, {', '.join(self.PROBE_COLUMNS)}) "
+            f"VALUES (?, ?, ?, {', '.join('?' * len(self.PROBE_COLUMNS))})",
+            (datetime.now(), target, mode, *(summary[column] for column in self.PROBE_COLUMNS))
+        )
+        conn.commit()
+        conn.close()
+
+    @traced("db.get_probe_summary", category="db")
+    def get_probe_summary(self, days=None):
+        """Сводка зондов за период, агрегированная в SQL; None, если зондов не было"""
+        query = '''
+            SELECT SUM(sent), SUM(lost), MIN(rtt_min),
+                   SUM(rtt_mean * (sent - lost)) / SUM(sent - lost),
+                   SUM(rtt_p50 * (sent - lost)) / SUM(sent - lost),
+                   MAX(rtt_p99), MAX(rtt_max),
+                   SUM(jitter * (sent - lost)) / SUM(sent - lost)
+            FROM probes
+        '''
+        params = []
+        if days:
+            query += " WHERE timestamp >= ?"
+            params.append(str(datetime.now() - timedelta(days=days)))
+
+        conn = self._connect()
+        row = conn.execute(query, params).fetchone()
+        conn.close()
+
+        if not row[0]:
+            return None
+        keys = ("sent", "lost", "rtt_min", "rtt_mean", "rtt_p50", "rtt_p99_max", "rtt_max", "jitter")
+        summary = dict(zip(keys, row))
+        summary["loss_pct"] = 100 * summary["lost"] / summary["sent"]
+        return summary
+
+    @traced("db.get_tests", category="db")
+    def get_tests(self, days=None):
+        import pandas as pd
+
+        conn = self._connect()
+        query = "SELECT * FROM tests WHERE success = 1 ORDER BY timestamp DESC"
+        if days:
+            cutoff = datetime.now() - timedelta(days=days)
+            query = f"SELECT * FROM tests WHERE success = 1 AND timestamp >= '{cutoff}' ORDER BY timestamp DESC"
+        df = pd.read_sql_query(query, conn)
+        conn.close()
+        return df
+
+    def iter_tests(self, since=None, until=None, server=None, include_failed=False, chunk_size=10000):
+        """Потоковое чтение tests порциями по chunk_size строк (словари не создаются).
+
+        Первым элементом возвращает список имен колонок, далее — списки кортежей.
+        """
+        conditions, params = [], []
+        if not include_failed:
+            conditions.append("success = 1")
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(str(since))
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append(str(until))
+        if server:
+            conditions.append("server_name = ?")
+            params.append(server)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        conn = self._connect()
+        try:
+            cursor = conn.execute(f"SELECT * FROM tests {where} ORDER BY id", params)
+            yield [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    def get_column_types(self):
+        """Объявленные типы колонок tests: {имя: тип}"""
+        conn = self._connect()
+        rows = conn.execute("PRAGMA table_info(tests)").fetchall()
+        conn.close()
+        return {row[1]: row[2].upper() for row in rows}
+
+    @traced("db.get_percentile", category="db")
+    def get_percentile(self, metric, q):
+        """Перцентиль метрики по гистограмме (верхняя граница корзины), без чтения tests"""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT bucket, count FROM metric_histogram WHERE metric = ? ORDER BY bucket",
+            (metric,)
+        ).fetchall()
+        conn.close()
+
+        total = sum(count for _, count in rows)
+        if not total:
+            return None
+
+        rank = q * total
+        seen = 0
+        for bucket, count in rows:
+            seen += count
+            if seen >= rank:
+                break
+        return 2 ** ((bucket + 1) / self.HISTOGRAM_RESOLUTION)
@@ -0,0 +1,173 @@
+"""Трассировка этапов теста и профилирование по запросу.
+
+Спаны (span, traced) записываются только после enable_tracing(); в
+выключенном состоянии span() возвращает общий пустой контекст, а
+декоратор traced добавляет одну проверку флага. Трасса сохраняется в
+формате Chrome Trace Event (открывается в chrome://tracing или Perfetto).
+
+Профилирование cProfile включается enable_profiling(): профиль снимается
+внутри profiled()-блоков в любом потоке и объединяется в один файл .prof
+(смотреть через python -m pstats или snakeviz).
+
+Переменные окружения SPEED_TRACE=trace.json и SPEED_PROFILE=run.prof
+включают то же самое без изменения кода; файлы пишутся при выходе.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+_NULL_SPAN = nullcontext()
+_lock = threading.Lock()
+_events = []
+_thread_names = {}
+_trace_path = None
+_profile_path = None
+_profile_stats = None
+_atexit_registered = False
+
+# Начало отсчета времени трассы
+_EPOCH = time.perf_counter()
+
+
+def tracing_enabled():
+    return _trace_path is not None
+
+
+def _register_atexit():
+    global _atexit_registered
+    if not _atexit_registered:
+        atexit.register(flush)
+        _atexit_registered = True
+
+
+def enable_tracing(path):
+    """Записывать спаны; при выходе (или flush()) сохранить трассу в path"""
+    global _trace_path
+    _trace_path = path
+    _register_atexit()
+
+
+def enable_profiling(path):
+    """Профилировать profiled()-блоки; при выходе (или flush()) сохранить профиль в path"""
+    global _profile_path
+    _profile_path = path
+    _register_atexit()
+
+
+def configure_from_env(environ=os.environ):
+    if environ.get("SPEED_TRACE"):
+        enable_tracing(environ["SPEED_TRACE"])
+    if environ.get("SPEED_PROFILE"):
+        enable_profiling(environ["SPEED_PROFILE"])
+
+
+def _record(name, category, started, finished, args):
+    thread = threading.current_thread()
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": (started - _EPOCH) * 1e6,
+        "dur": (finished - started) * 1e6,
+        "pid": os.getpid(),
+        "tid": thread.ident,
+    }
+    if args:
+        event["args"] = args
+    with _lock:
+        _events.append(event)
+        _thread_names.setdefault(thread.ident, thread.name)
+
+
+@contextmanager
+def _span(name, category, args):
+    started = time.perf_counter()
+    try:
+        yield args
+    finally:
+        _record(name, category, started, time.perf_counter(), args)
+
+
+def span(name, category="app", **args):
+    """Контекст, отмечающий интервал в трассе; без трассировки ничего не делает"""
+    if _trace_path is None:
+        return _NULL_SPAN
+    return _span(name, category, args)
+
+
+def traced(name=None, category="app"):
+    """Декоратор: вызов функции становится спаном"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _trace_path is None:
+                return func(*args, **kwargs)
+            with _span(span_name, category, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def _profiled():
+    import cProfile
+    import pstats
+
+    global _profile_stats
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+: одновременно активен только один профилировщик (вложенный блок
+        # или другой поток) — этот блок попадет в уже идущий профиль или будет пропущен
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _lock:
+            if _profile_stats is None:
+                _profile_stats = pstats.Stats(profiler)
+            else:
+                _profile_stats.add(profiler)
+
+
+def profiled():
+    """Контекст, внутри которого текущий поток профилируется cProfile (если включено)"""
+    if _profile_path is None:
+        return _NULL_SPAN
+    return _profiled()
+
+
+def write_trace(path):
+    """Сохранить накопленные спаны в формате Chrome Trace Event"""
+    with _lock:
+        events = list(_events)
+        names = dict(_thread_names)
+    pid = os.getpid()
+    metadata = [
+        {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}}
+        for tid, thread_name in names.items()
+    ]
+    with open(path, "w", encoding="utf-8") as stream:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, stream, ensure_ascii=False)
+
+
+def flush():
+    """Записать трассу и профиль в файлы, заданные при включении"""
+    if _trace_path is not None:
+        write_trace(_trace_path)
+    with _lock:
+        stats = _profile_stats
+    if _profile_path is not None and stats is not None:
+        stats.dump_stats(_profile_path)
+
+
+configure_from_env()
@@ -0,0 +1,94 @@
+import random
+import sqlite3
+
+from speed_anomaly import AnomalyDetector, SeriesDetector
+
+
+def feed(detector, values, direction):
+    return [detector.update(value, direction) for value in values]
+
+
+def test_stationary_ping_noise_is_quiet():
+    rng = random.Random(7)
+    detector = SeriesDetector(log_scale=True)
+    findings = feed(detector, (rng.lognormvariate(3.0, 0.4) for _ in range(2000)), direction=1)
+    assert sum(len(found) for found in findings) <= 1
+
+
+def test_single_outlier_is_not_reported():
+    detector = SeriesDetector(log_scale=True)
+    feed(detector, [20, 21, 19, 20, 22, 20, 21, 19, 20, 21], direction=1)
+    assert detector.update(200, 1) == []
+    assert feed(detector, [20, 21, 20], direction=1) == [[], [], []]
+
+
+def test_repeated_outlier_is_reported_once():
+    detector = SeriesDetector(log_scale=True)
+    feed(detector, [20, 21, 19, 20, 22, 20, 21, 19, 20, 21], direction=1)
+    findings = feed(detector, [200, 210], direction=1)
+    assert findings[0] == []
+    (kind, baseline, score), = [item for item in findings[1] if item[0] == "outlier"]
+    assert 19 <= baseline <= 22  # База в исходных единицах, не в логарифме
+    assert score > SeriesDetector.OUTLIER_Z
+
+
+def test_outlier_in_the_good_direction_is_ignored():
+    detector = SeriesDetector()
+    feed(detector, [100, 102, 98, 101, 99, 100, 103, 97, 100, 101], direction=-1)
+    assert feed(detector, [500, 500, 500], direction=-1) == [[], [], []]
+
+
+def test_level_shift_is_detected():
+    rng = random.Random(3)
+    detector = SeriesDetector()
+    feed(detector, (90 * rng.lognormvariate(0, 0.1) for _ in range(60)), direction=-1)
+    for step in range(20):
+        found = detector.update(40 * rng.lognormvariate(0, 0.1), -1)
+        if any(kind == "shift" for kind, _, _ in found):
+            break
+    else:
+        raise AssertionError("Сдвиг не обнаружен")
+    assert step < 10
+
+
+def test_state_round_trip_and_scale_change():
+    detector = SeriesDetector(log_scale=True)
+    feed(detector, [20, 21, 19, 20, 22], direction=1)
+    restored = SeriesDetector(detector.state(), log_scale=True)
+    assert restored.state() == detector.state()
+    # Состояние из другой шкалы не используется
+    assert SeriesDetector(detector.state(), log_scale=False).count == 0
+
+
+def make_cursor():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE detector_state (key TEXT PRIMARY KEY, state TEXT)")
+    conn.execute("CREATE TABLE anomalies (timestamp, scope, name, metric, value, baseline, score, kind)")
+    return conn.cursor()
+
+
+def rows(pings, server="MTS"):
+    return [{"timestamp": f"2026-10-12 12:{minute:02d}:00", "ping": ping, "download": 100, "upload": 50,
+             "server_name": server} for minute, ping in enumerate(pings)]
+
+
+def test_process_records_and_persists_state():
+    cursor = make_cursor()
+    detector = AnomalyDetector()
+    detector.process(cursor, rows([20, 21, 19, 20, 22, 20, 21, 19, 20, 21]))
+    found = detector.process(cursor, rows([200, 210]))
+    assert {(a.scope, a.metric, a.kind) for a in found} >= {("server", "ping", "outlier")}
+    assert cursor.execute("SELECT COUNT(*) FROM anomalies").fetchone()[0] == len(found)
+    assert cursor.execute("SELECT COUNT(*) FROM detector_state").fetchone()[0] > 0
+
+
+def test_process_without_recording():
+    cursor = make_cursor()
+    detector = AnomalyDetector()
+    assert detector.process(cursor, rows([20, 21, 19, 20, 22, 20, 21, 19, 20, 21, 200, 210]), record=False) == []
+    assert cursor.execute("SELECT COUNT(*) FROM anomalies").fetchone()[0] == 0
+
+
+def test_series_are_kept_per_probe():
+    keys = AnomalyDetector.series_keys({"timestamp": "2026-10-12 09:15:00", "server_name": "MTS", "probe": "kazan"})
+    assert keys == [("hour", "kazan/09"), ("server", "kazan/MTS")]
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from speed_export import export_tests
+from speed_fleet import AggregationError, aggregate, parse_source, probe_name
+from speed_storage import DatabaseManager
+
+START = datetime(2026, 10, 1)
+
+
+def make_rows(count, offset=0, ping=20.0):
+    return [
+        DatabaseManager.make_row(ping + (i % 3), 100.0 + (i % 5), 50.0, "MTS", "Russia",
+                                 timestamp=START + timedelta(minutes=15 * (offset + i)))
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def central(tmp_path):
+    return DatabaseManager(str(tmp_path / "fleet.db"))
+
+
+@pytest.fixture
+def source(tmp_path):
+    db = DatabaseManager(str(tmp_path / "kazan.db"))
+    db.save_tests(make_rows(50))
+    return db
+
+
+def count_rows(db, probe):
+    conn = sqlite3.connect(db.db_file)
+    try:
+        return conn.execute("SELECT COUNT(*), COUNT(DISTINCT timestamp) FROM tests WHERE probe = ?",
+                            (probe,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_incremental_collection(central, source):
+    assert aggregate(central, [("kazan", source.db_file)], chunk_size=7) == {"kazan": 50}
+    assert aggregate(central, [("kazan", source.db_file)]) == {"kazan": 0}
+
+    source.save_tests(make_rows(5, offset=50))
+    assert aggregate(central, [("kazan", source.db_file)]) == {"kazan": 5}
+    assert count_rows(central, "kazan") == (55, 55)
+    assert central.get_high_water("kazan") == 55
+
+
+def test_history_backfill_is_not_reported(central, source):
+    # В истории пробы есть устойчивый рост ping — при первом сборе это не новое событие
+    source.save_tests(make_rows(30, offset=50, ping=200.0))
+    reported = []
+    central.add_anomaly_listener(reported.extend)
+    aggregate(central, [("kazan", source.db_file)])
+    assert reported == []
+    assert central.get_anomalies(limit=1000) == []
+
+    # Новые результаты после первого сбора проверяются как обычно
+    source.save_tests(make_rows(30, offset=80, ping=2000.0))
+    aggregate(central, [("kazan", source.db_file)])
+    assert reported
+    assert central.get_anomalies(limit=1000)
+
+
+def test_recreated_source_is_reported(central, source, tmp_path):
+    aggregate(central, [("kazan", source.db_file)])
+    os.remove(source.db_file)
+    DatabaseManager(source.db_file).save_tests(make_rows(3, offset=100))
+    result = aggregate(central, [("kazan", source.db_file)])
+    assert "меньше уже собранного" in result["kazan"]
+    assert count_rows(central, "kazan") == (50, 50)
+
+
+def test_collection_from_export(central, source, tmp_path):
+    path = str(tmp_path / "kazan.csv")
+    export_tests(source, path, "csv")
+    assert aggregate(central, [("kazan", path)]) == {"kazan": 50}
+    assert aggregate(central, [("kazan", path)]) == {"kazan": 0}
+
+
+def test_source_errors_do_not_stop_other_sources(central, source, tmp_path):
+    result = aggregate(central, [("kazan", source.db_file), ("omsk", str(tmp_path / "missing.db"))])
+    assert result["kazan"] == 50
+    assert "не найден" in result["omsk"]
+
+
+def test_duplicate_probe_names(central, source):
+    with pytest.raises(AggregationError):
+        aggregate(central, [("kazan", source.db_file), ("kazan", source.db_file)])
+
+
+def test_probe_names(tmp_path):
+    assert probe_name("/data/omsk.csv") == "omsk"
+    assert probe_name(f"/data/kazan/{DatabaseManager.DEFAULT_DB_FILE}") == "kazan"
+    assert parse_source("kazan=/data/x.db") == ("kazan", "/data/x.db")
+    assert parse_source("/data/omsk.jsonl") == ("omsk", "/data/omsk.jsonl")
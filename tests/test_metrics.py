@@ -0,0 +1,78 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from speed_metrics import CONTENT_TYPE, Counter, Gauge, Histogram, MetricsServer, Registry
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_and_gauge_exposition(registry):
+    tests = Counter("tests_total", "Число тестов", labels=("result",), registry=registry)
+    tests.inc(result="success")
+    tests.inc(2, result="success")
+    tests.inc(result="error")
+    Gauge("last_download_mbps", "Скорость", registry=registry).set(93.5)
+    Counter("fallbacks_total", "Без меток", registry=registry)
+
+    assert registry.render() == (
+        "# HELP tests_total Число тестов\n"
+        "# TYPE tests_total counter\n"
+        'tests_total{result="success"} 3\n'
+        'tests_total{result="error"} 1\n'
+        "# HELP last_download_mbps Скорость\n"
+        "# TYPE last_download_mbps gauge\n"
+        "last_download_mbps 93.5\n"
+        "# HELP fallbacks_total Без меток\n"
+        "# TYPE fallbacks_total counter\n"
+        "fallbacks_total 0\n"
+    )
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = Histogram("stage_seconds", "Этапы", labels=("stage",), buckets=(1, 5), registry=registry)
+    for value in (0.5, 2, 7):
+        histogram.observe(value, stage="download")
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'stage_seconds_bucket{stage="download",le="1"} 1',
+        'stage_seconds_bucket{stage="download",le="5"} 2',
+        'stage_seconds_bucket{stage="download",le="+Inf"} 3',
+        'stage_seconds_sum{stage="download"} 9.5',
+        'stage_seconds_count{stage="download"} 3',
+    ]
+
+
+def test_label_values_are_escaped(registry):
+    Gauge("server_info", "Сервер", labels=("name",), registry=registry).set(1, name='a "b"\\c\nd')
+    assert 'server_info{name="a \\"b\\"\\\\c\\nd"} 1' in registry.render()
+
+
+def test_labels_must_match(registry):
+    counter = Counter("tests_total", "Число тестов", labels=("result",), registry=registry)
+    with pytest.raises(ValueError):
+        counter.inc(stage="x")
+
+
+def test_duplicate_names_are_rejected(registry):
+    Gauge("value", "Первая", registry=registry)
+    with pytest.raises(ValueError):
+        Gauge("value", "Вторая", registry=registry)
+
+
+def test_metrics_server(registry):
+    Gauge("value", "Значение", registry=registry).set(1)
+    server = MetricsServer(port=0, host="127.0.0.1", registry=registry).start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5) as response:
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            assert response.read().decode("utf-8") == registry.render()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other", timeout=5)
+        assert error.value.code == 404
+    finally:
+        server.stop()
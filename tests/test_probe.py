@@ -0,0 +1,71 @@
+import random
+import statistics
+
+import pytest
+
+from speed_probe import P2Quantile, StreamingStats, parse_target
+
+
+@pytest.mark.parametrize("q", [0.5, 0.9, 0.99])
+def test_p2_quantile_tracks_exact_quantile(q):
+    rng = random.Random(11)
+    values = [rng.lognormvariate(3.0, 0.5) for _ in range(20000)]
+    estimator = P2Quantile(q)
+    for value in values:
+        estimator.add(value)
+    exact = sorted(values)[int(q * (len(values) - 1))]
+    assert estimator.value() == pytest.approx(exact, rel=0.03)
+
+
+def test_p2_quantile_with_few_values():
+    estimator = P2Quantile(0.5)
+    assert estimator.value() is None
+    for value in (5, 1, 3):
+        estimator.add(value)
+    assert estimator.value() == 3
+
+
+def test_streaming_stats_summary():
+    stats = StreamingStats()
+    rtts = [10.0, 12.0, None, 11.0, 30.0, None, 10.5]
+    for rtt in rtts:
+        stats.add(rtt)
+    received = [rtt for rtt in rtts if rtt is not None]
+    summary = stats.summary()
+    assert summary["sent"] == 7
+    assert summary["lost"] == 2
+    assert summary["loss_pct"] == pytest.approx(100 * 2 / 7)
+    assert summary["rtt_mean"] == pytest.approx(statistics.mean(received))
+    assert summary["rtt_stdev"] == pytest.approx(statistics.stdev(received))
+    assert (summary["rtt_min"], summary["rtt_max"]) == (10.0, 30.0)
+
+
+def test_jitter_of_constant_latency_is_zero():
+    stats = StreamingStats()
+    for _ in range(100):
+        stats.add(20.0)
+    assert stats.summary()["jitter"] == 0
+
+
+def test_empty_stats():
+    summary = StreamingStats().summary()
+    assert summary["sent"] == 0
+    assert summary["loss_pct"] is None
+    assert summary["rtt_p50"] is None
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("example.net", ("example.net", 443)),
+    ("example.net:8080", ("example.net", 8080)),
+    ("[2001:db8::1]", ("2001:db8::1", 443)),
+    ("[2001:db8::1]:53", ("2001:db8::1", 53)),
+    ("2001:db8::1", ("2001:db8::1", 443)),
+])
+def test_parse_target(text, expected):
+    assert parse_target(text) == expected
+
+
+@pytest.mark.parametrize("text", ["host:abc", "host:0", "host:70000", "[::1]:x"])
+def test_parse_target_rejects_bad_port(text):
+    with pytest.raises(ValueError):
+        parse_target(text)
@@ -0,0 +1,173 @@
+import threading
+import time
+from datetime import datetime, time as dtime
+
+import pytest
+
+import speed_scheduler
+from speed_scheduler import CronSchedule, IntervalSchedule, QuietHours, ScheduleError, parse_schedule
+
+
+def test_parse_schedule_interval_and_cron():
+    assert parse_schedule("15m").interval.total_seconds() == 900
+    assert parse_schedule("every 2h").interval.total_seconds() == 7200
+    assert isinstance(parse_schedule("*/30 * * * *"), CronSchedule)
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "61 * * * *", "*/0 * * * *", "5-1 * * * *", "a * * * *"])
+def test_cron_rejects_invalid_expressions(expression):
+    with pytest.raises(ScheduleError):
+        CronSchedule(expression)
+
+
+def test_cron_that_never_fires():
+    with pytest.raises(ScheduleError):
+        CronSchedule("0 0 31 2 *").next_after(datetime(2026, 1, 1))
+
+
+def test_cron_step_and_next_after():
+    schedule = CronSchedule("*/15 * * * *")
+    assert schedule.next_after(datetime(2026, 10, 12, 10, 7, 30)) == datetime(2026, 10, 12, 10, 15)
+    # Ровно в момент срабатывания следующий запуск — уже следующий слот
+    assert schedule.next_after(datetime(2026, 10, 12, 10, 15)) == datetime(2026, 10, 12, 10, 30)
+
+
+def test_cron_day_of_month_or_day_of_week():
+    # 13-е число или пятница; 2026-10-12 — понедельник
+    schedule = CronSchedule("0 9 13 * 5")
+    first = schedule.next_after(datetime(2026, 10, 12, 12, 0))
+    assert first == datetime(2026, 10, 13, 9, 0)
+    assert schedule.next_after(first) == datetime(2026, 10, 16, 9, 0)
+
+
+def test_cron_only_day_of_week_restricted():
+    schedule = CronSchedule("0 9 * * 1")
+    assert schedule.next_after(datetime(2026, 10, 12, 10, 0)) == datetime(2026, 10, 19, 9, 0)
+    # 7 — тоже воскресенье
+    assert CronSchedule("0 0 * * 7").weekdays == {0}
+
+
+def test_quiet_hours_across_midnight():
+    quiet = QuietHours.parse("23:00-07:00")
+    assert quiet.contains(datetime(2026, 10, 12, 23, 30))
+    assert quiet.contains(datetime(2026, 10, 13, 6, 59))
+    assert not quiet.contains(datetime(2026, 10, 13, 7, 0))
+    assert quiet.end_after(datetime(2026, 10, 12, 23, 30)) == datetime(2026, 10, 13, 7, 0)
+    with pytest.raises(ScheduleError):
+        QuietHours.parse("25:00-07:00")
+
+
+def test_next_run_leaves_quiet_hours():
+    scheduler = speed_scheduler.TestScheduler(IntervalSchedule(3600), job=lambda: True,
+                                              quiet_hours=QuietHours(dtime(23, 0), dtime(7, 0)))
+    assert scheduler.compute_next_run(datetime(2026, 10, 12, 22, 30)) == datetime(2026, 10, 13, 7, 0)
+
+
+def test_backoff_is_added_on_top_of_schedule():
+    scheduler = speed_scheduler.TestScheduler(IntervalSchedule(60), job=lambda: True,
+                                              backoff_base=60, max_backoff=300)
+    now = datetime(2026, 10, 12, 12, 0)
+    expected = {0: 60, 1: 120, 2: 180, 3: 300, 4: 360, 10: 360}
+    for failures, delay in expected.items():
+        scheduler.failures = failures
+        assert (scheduler.compute_next_run(now) - now).total_seconds() == delay
+
+
+def run_scheduler(scheduler, seconds):
+    scheduler.start(run_now=True)
+    try:
+        time.sleep(seconds)
+    finally:
+        scheduler.stop(5)
+
+
+def test_failures_delay_following_runs():
+    runs = []
+
+    def job():
+        runs.append(time.monotonic())
+        return False
+
+    scheduler = speed_scheduler.TestScheduler(IntervalSchedule(0.1), job, backoff_base=0.3, max_backoff=10)
+    run_scheduler(scheduler, 2.0)
+    gaps = [later - earlier for earlier, later in zip(runs, runs[1:])]
+    # Пауза после каждой ошибки удваивается: 0.1 + 0.3, 0.1 + 0.6, 0.1 + 1.2
+    assert len(runs) == 3
+    assert gaps[0] == pytest.approx(0.4, abs=0.15)
+    assert gaps[1] == pytest.approx(0.7, abs=0.15)
+    assert scheduler.failures == 3
+
+
+def test_success_resets_failures():
+    results = iter([False, False, True])
+
+    def job():
+        return next(results, True)
+
+    scheduler = speed_scheduler.TestScheduler(IntervalSchedule(0.05), job, backoff_base=0.05)
+    run_scheduler(scheduler, 0.8)
+    assert scheduler.failures == 0
+
+
+def test_busy_job_is_skipped():
+    release = threading.Event()
+    runs = []
+
+    def job():
+        runs.append(time.monotonic())
+        release.wait(5)
+        return True
+
+    scheduler = speed_scheduler.TestScheduler(IntervalSchedule(0.1), job)
+    try:
+        run_scheduler(scheduler, 0.5)
+    finally:
+        release.set()
+    assert len(runs) == 1
+    assert scheduler.skipped >= 2
+
+
+def test_hung_job_is_preempted():
+    release = threading.Event()
+    runs = []
+
+    def job():
+        runs.append(time.monotonic())
+        released = release.wait(5)
+        release.clear()
+        return None if released else True
+
+    scheduler = speed_scheduler.TestScheduler(IntervalSchedule(0.3), job, cancel=release.set,
+                                              max_runtime=0.2, cancel_timeout=2)
+    run_scheduler(scheduler, 1.0)
+    release.set()
+    assert scheduler.preempted >= 1
+    assert len(runs) >= 2
+    # Отмененный тест не считается ошибкой
+    assert scheduler.failures == 0
+
+
+def test_stop_during_preemption_does_not_start_new_job():
+    release = threading.Event()
+    runs = []
+
+    def job():
+        runs.append(time.monotonic())
+        release.wait(5)
+        return True
+
+    def cancel():
+        # Тест останавливается не сразу после отмены
+        threading.Timer(1.0, release.set).start()
+
+    scheduler = speed_scheduler.TestScheduler(IntervalSchedule(0.2), job, cancel=cancel,
+                                              max_runtime=0.1, cancel_timeout=5)
+    scheduler.start(run_now=True)
+    time.sleep(0.5)  # Планировщик уже ждет отмененный тест
+    started = time.monotonic()
+    scheduler.stop(5)
+    assert time.monotonic() - started < 1.0
+    assert scheduler.wait_idle(5)
+    time.sleep(0.1)
+    assert len(runs) == 1
+    assert not scheduler.is_busy()